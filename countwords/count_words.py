@@ -1,21 +1,222 @@
-ifile = open("count_words.dat")
+"""
+Counts the occurrences of the words of text files and prints the words
+grouped by number of occurrences, most frequent first, or the top K words.
 
-words = []
-for line in ifile:
-  words += list(line[:-1].split())
+The files are read in fixed-size chunks, so that the memory used does not
+depend on the size of the files, but only on the number of distinct words.
+The chunks go through a pipeline of tokenizer stages (normalization, case
+folding, stop words...) defined in tokenizers.py.
 
-word_counts = {}
-for w in set(words):
-  word_counts[w] = words.count(w) 
+Files (or all the files of directory trees) are split at whitespace into
+byte ranges, which are counted in parallel by a pool of processes, each
+reading its ranges through mmap. The partial counts are then merged, e.g.
+  python count_words.py -j 8 corpus/
 
+With --index, the counts are stored in a persistent index, and only new or
+modified files are counted on the next runs (see word_index.py).
+"""
+import os
+import re
+import mmap
+import argparse
+import multiprocessing
+from collections import Counter
 
+import tokenizers
 
-for nOccurrences in range(10,0,-1):
-  w = [k for k, v in word_counts.items() if v==nOccurrences]
-  if len(w) == 0:
-    continue 
-  print ("## Words appearing %d times" % nOccurrences)   
-  print ("-----------------------------")   
-  print (", ".join(w))
-  print ( ) 
+## Splitting at ASCII whitespace never cuts a word nor a UTF-8 character
+_WHITESPACE_ = re.compile (rb"\s")
 
+
+def iter_chunks (ifile, chunk_size = 1 << 20):
+  """
+  Yields the text of a file by chunks of about chunk_size characters, each
+  ending on whitespace (or at the end of the file), so that no word is cut
+  """
+  carry = ""
+  while True:
+    chunk = ifile.read (chunk_size)
+    if not chunk:
+      break
+    chunk = carry + chunk
+    ## A word at the end of the chunk may continue in the next one
+    cut = len(chunk)
+    while cut > 0 and not chunk[cut-1].isspace():
+      cut -= 1
+    if cut == 0:
+      carry = chunk
+      continue
+    carry = chunk[cut:]
+    yield chunk[:cut]
+
+  if carry:
+    yield carry
+
+
+def iter_words (ifile, chunk_size = 1 << 20, tokenizer = "split"):
+  "Yields the words of a file, as obtained by the tokenizer pipeline"
+  return tokenizers.pipeline (tokenizer, iter_chunks (ifile, chunk_size))
+
+
+def count_words (ifile, chunk_size = 1 << 20, tokenizer = "split"):
+  "Returns the Counter of the words of a file"
+  word_counts = Counter()
+  word_counts.update (iter_words (ifile, chunk_size, tokenizer))
+  return word_counts
+
+
+def list_files (paths):
+  "Lists the files of paths, exploring the directories recursively"
+  files = []
+  for path in paths:
+    if os.path.isdir (path):
+      for dirpath, dirnames, filenames in os.walk (path):
+        dirnames.sort()
+        files += [os.path.join (dirpath, f) for f in sorted (filenames)]
+    else:
+      files.append (path)
+  return files
+
+
+def boundaries (mm, begin, end, step):
+  """
+  Offsets splitting the bytes [begin, end) of mm into pieces of about step
+  bytes, each piece ending on whitespace (or at end)
+  """
+  offsets = [begin]
+  while offsets[-1] < end:
+    match = _WHITESPACE_.search (mm, min(offsets[-1] + step, end), end)
+    offsets.append (match.end() if match is not None else end)
+  return offsets
+
+
+def split_file (path, range_size):
+  "Splits a file into the list of (path, begin, end) byte ranges"
+  size = os.path.getsize (path)
+  if size == 0:
+    return []
+  with open (path, "rb") as f, mmap.mmap (f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+    offsets = boundaries (mm, 0, size, range_size)
+  return [(path, begin, end) for begin, end in zip (offsets[:-1], offsets[1:])]
+
+
+def count_range (path, begin, end, chunk_size = 1 << 20, tokenizer = "split"):
+  "Returns the Counter of the words in the bytes [begin, end) of a file"
+  word_counts = Counter()
+  with open (path, "rb") as f, mmap.mmap (f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+    offsets = boundaries (mm, begin, end, chunk_size)
+    chunks = (mm[b:e].decode ("utf-8", errors = "replace")
+              for b, e in zip (offsets[:-1], offsets[1:]))
+    word_counts.update (tokenizers.pipeline (tokenizer, chunks))
+  return word_counts
+
+
+def _count_range (args):
+  return args[0], count_range (*args)
+
+
+def iter_range_counts (files, workers = 1, range_size = 64 << 20, chunk_size = 1 << 20,
+                       tokenizer = "split"):
+  """
+  Yields the (path, Counter) of the words of each range of about
+  range_size bytes of the files, counted by a pool of workers processes
+  """
+  tasks = [(path, begin, end, chunk_size, tokenizer)
+           for f in files for path, begin, end in split_file (f, range_size)]
+  if workers <= 1:
+    for task in tasks:
+      yield _count_range (task)
+    return
+
+  with multiprocessing.Pool (workers) as pool:
+    yield from pool.imap_unordered (_count_range, tasks)
+
+
+def count_files (files, workers = 1, range_size = 64 << 20, chunk_size = 1 << 20,
+                 tokenizer = "split"):
+  """
+  Returns the Counter of the words of the files, split into ranges of
+  about range_size bytes counted by a pool of workers processes
+  """
+  word_counts = Counter()
+  for path, partial_counts in iter_range_counts (files, workers, range_size, chunk_size,
+                                                 tokenizer):
+    word_counts.update (partial_counts)
+  return word_counts
+
+
+def count_each_file (files, workers = 1, range_size = 64 << 20, chunk_size = 1 << 20,
+                     tokenizer = "split"):
+  """
+  Returns the dictionary path -> Counter of the words of each file, the
+  ranges of all the files being counted by the same pool of processes
+  """
+  file_counts = {path: Counter() for path in files}
+  for path, partial_counts in iter_range_counts (files, workers, range_size, chunk_size,
+                                                 tokenizer):
+    file_counts[path].update (partial_counts)
+  return file_counts
+
+
+def group_by_count (word_counts):
+  "Returns the list of (count, words), most frequent first"
+  groups = {}
+  for w, n in word_counts.items():
+    groups.setdefault (n, []).append (w)
+  return sorted (groups.items(), reverse = True)
+
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument ("paths", nargs = '*', default = ["count_words.dat"],
+      help = "Text files or directories")
+  parser.add_argument ("-k", "--top", default = 0, type = int,
+      help = "Print only the K most frequent words")
+  parser.add_argument ("-j", "--workers", default = 1, type = int,
+      help = "Processes counting the byte ranges of the files")
+  parser.add_argument ("--range-size", default = 64 << 20, type = int,
+      help = "Bytes of the ranges the files are split into")
+  parser.add_argument ("--chunk-size", default = 1 << 20, type = int,
+      help = "Bytes decoded at once")
+  parser.add_argument ("-t", "--tokenizer", default = "split",
+      help = "Comma-separated stages of the tokenizer, e.g. citations,translate,lower,stop "
+             "(see tokenizers.py)")
+  parser.add_argument ("--index", default = None,
+      help = "Word index (SQLite) updated with the new or modified files, see word_index.py")
+  parser.add_argument ("--exactly", default = None, type = int,
+      help = "Print only the words appearing exactly N times")
+  parser.add_argument ("--word", default = None,
+      help = "Print only the number of occurrences of a word")
+  cfg = parser.parse_args()
+
+  if cfg.index is not None:
+    import word_index
+    index = word_index.WordIndex (cfg.index)
+    index.update (list_files (cfg.paths), cfg.workers, cfg.range_size, cfg.chunk_size,
+                  cfg.tokenizer)
+    count = index.count
+    exactly = index.exactly
+    top = index.top
+    groups = index.group_by_count
+  else:
+    word_counts = count_files (list_files (cfg.paths), cfg.workers,
+                               cfg.range_size, cfg.chunk_size, cfg.tokenizer)
+    count = lambda w: word_counts[w]
+    exactly = lambda n: [w for w, c in word_counts.items() if c == n]
+    top = word_counts.most_common
+    groups = lambda: group_by_count (word_counts)
+
+  if cfg.word is not None:
+    print ("%d" % count (cfg.word))
+  elif cfg.exactly is not None:
+    print (", ".join (exactly (cfg.exactly)))
+  elif cfg.top > 0:
+    for w, nOccurrences in top (cfg.top):
+      print ("%7d %s" % (nOccurrences, w))
+  else:
+    for nOccurrences, w in groups():
+      print ("## Words appearing %d times" % nOccurrences)
+      print ("-----------------------------")
+      print (", ".join(w))
+      print ( )
@@ -0,0 +1,135 @@
+"""
+Tokenizers
+----------
+
+Pipelines turning a stream of text chunks into a stream of words. Each
+stage is a generator taking the iterable produced by the previous one:
+  - chunk stages, from chunks to chunks:
+      citations  removes citation markers such as [3]
+  - tokenizers, from chunks to words:
+      split      splits at whitespace (the historical behaviour)
+      regex      keeps the runs of letters and digits (with inner apostrophes)
+      translate  replaces punctuation by spaces (translate table), then splits
+  - word stages, from words to words:
+      strip      strips the punctuation at both ends of the words
+      lower      case folding
+      stop       drops the stop words
+
+A pipeline is defined by the comma-separated names of its stages, e.g.
+"citations,translate,lower,stop". Chunks must end on whitespace, so that
+no word is cut (see count_words.iter_chunks).
+
+Running this module compares the throughput of some pipelines on the
+sample text repeated many times, e.g.
+  python tokenizers.py --repeat 2000
+"""
+import re
+import string
+
+_CITATION_ = re.compile (r"\[\d+\]")
+_WORD_ = re.compile (r"\w+(?:['’]\w+)*")
+
+## ASCII punctuation and the most common unicode quotes, dashes...
+PUNCTUATION = string.punctuation + "“”‘’«»‹›„–—…¡¿·•"
+_TO_SPACE_ = str.maketrans (PUNCTUATION, " " * len(PUNCTUATION))
+
+STOP_WORDS = frozenset ("""
+a about after all also an and any are as at be been but by can could did do
+does for from had has have he her his how i if in into is it its may more
+most no not of on one or other our out she so some such than that the their
+them then there these they this to up was we were what when which who will
+with would you your
+""".split())
+
+
+def citations (chunks):
+  for chunk in chunks:
+    yield _CITATION_.sub (" ", chunk)
+
+
+def split (chunks):
+  for chunk in chunks:
+    yield from chunk.split()
+
+
+def regex (chunks):
+  for chunk in chunks:
+    yield from _WORD_.findall (chunk)
+
+
+def translate (chunks):
+  for chunk in chunks:
+    yield from chunk.translate (_TO_SPACE_).split()
+
+
+def strip (words):
+  for w in words:
+    w = w.strip (PUNCTUATION)
+    if w:
+      yield w
+
+
+def lower (words):
+  for w in words:
+    yield w.casefold()
+
+
+def stop (words):
+  for w in words:
+    if w not in STOP_WORDS:
+      yield w
+
+
+CHUNK_STAGES = dict(citations = citations)
+TOKENIZERS = dict(split = split, regex = regex, translate = translate)
+WORD_STAGES = dict(strip = strip, lower = lower, stop = stop)
+STAGES = dict(**CHUNK_STAGES, **TOKENIZERS, **WORD_STAGES)
+
+
+def pipeline (spec, chunks):
+  """
+  Applies the stages named in spec (comma-separated) to the chunks: chunk
+  stages, then exactly one tokenizer, then word stages
+  """
+  names = spec.split (",")
+  for name in names:
+    if name not in STAGES:
+      raise ValueError ("Unknown tokenizer stage %s, available: %s" % (
+        name, ", ".join (STAGES)))
+  kinds = [0 if n in CHUNK_STAGES else 1 if n in TOKENIZERS else 2 for n in names]
+  if kinds.count (1) != 1 or kinds != sorted (kinds):
+    raise ValueError ("Tokenizer %s should be chunk stages, one tokenizer among %s, "
+                      "then word stages" % (spec, ", ".join (TOKENIZERS)))
+
+  stream = chunks
+  for name in names:
+    stream = STAGES[name] (stream)
+  return stream
+
+
+
+if __name__ == '__main__':
+  import io
+  import time
+  import argparse
+  import count_words
+  parser = argparse.ArgumentParser()
+  parser.add_argument ("filename", nargs = '?', default = "count_words.dat")
+  parser.add_argument ("-r", "--repeat", default = 2000, type = int,
+      help = "Times the sample text is repeated")
+  parser.add_argument ("-t", "--tokenizers", nargs = '*', default = [
+      "split", "regex", "translate", "split,strip", "regex,lower",
+      "citations,translate,lower", "citations,translate,lower,stop"])
+  cfg = parser.parse_args()
+
+  with open (cfg.filename, encoding = "utf-8") as f:
+    text = f.read() * cfg.repeat
+  print ("%d characters" % len(text))
+
+  for spec in cfg.tokenizers:
+    start = time.perf_counter()
+    word_counts = count_words.count_words (io.StringIO (text), tokenizer = spec)
+    elapsed = time.perf_counter() - start
+    n_words = sum (word_counts.values())
+    print ("%-32s %9d words %6d distinct %8.3f s %10.0f words/s" % (
+      spec, n_words, len(word_counts), elapsed, n_words / elapsed))
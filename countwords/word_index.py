@@ -0,0 +1,143 @@
+"""
+Persistent word index
+---------------------
+
+SQLite database storing the word counts of each file, together with its
+size and modification time, and the total counts over all the files.
+Updating the index counts only the new or modified files (see
+count_words.count_each_file), and merges their counts into the totals; files
+which disappeared are removed from the totals.
+
+Queries (top K words, words with exactly N occurrences, occurrences of a
+word, words grouped by count) are answered from the index, without reading
+the text again, e.g.
+  python count_words.py --index words.db corpus/ --exactly 3
+"""
+import os
+import sqlite3
+
+import count_words
+
+_SCHEMA_ = """
+CREATE TABLE IF NOT EXISTS files (
+  id INTEGER PRIMARY KEY,
+  path TEXT UNIQUE NOT NULL,
+  size INTEGER NOT NULL,
+  mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS file_words (
+  file_id INTEGER NOT NULL REFERENCES files(id),
+  word TEXT NOT NULL,
+  count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS file_words_file ON file_words (file_id);
+CREATE TABLE IF NOT EXISTS totals (
+  word TEXT PRIMARY KEY,
+  count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS totals_count ON totals (count);
+CREATE TABLE IF NOT EXISTS meta (
+  key TEXT PRIMARY KEY,
+  value TEXT NOT NULL
+);
+"""
+
+
+class WordIndex:
+  "Word counts of a set of files, stored in the SQLite database path"
+  def __init__ (self, path):
+    self.db = sqlite3.connect (path)
+    self.db.executescript (_SCHEMA_)
+
+
+  def close (self):
+    self.db.close()
+
+
+  def _remove (self, file_id):
+    "Subtracts the counts of a file from the totals and forgets them"
+    ## One lookup of the primary key of totals per word of the file
+    word_counts = self.db.execute (
+      "SELECT count, word FROM file_words WHERE file_id = ?", (file_id,)).fetchall()
+    self.db.executemany ("UPDATE totals SET count = count - ? WHERE word = ?", word_counts)
+    self.db.execute ("DELETE FROM totals WHERE count <= 0")
+    self.db.execute ("DELETE FROM file_words WHERE file_id = ?", (file_id,))
+    self.db.execute ("DELETE FROM files WHERE id = ?", (file_id,))
+
+
+  def update (self, files, workers = 1, range_size = 64 << 20, chunk_size = 1 << 20,
+              tokenizer = "split"):
+    """
+    Counts the files which are new or whose size or modification time has
+    changed, and forgets the indexed files which do not exist anymore.
+    All the files of an index are counted with the same tokenizer.
+    Returns the number of files counted.
+    """
+    row = self.db.execute ("SELECT value FROM meta WHERE key = 'tokenizer'").fetchone()
+    if row is None:
+      with self.db:
+        self.db.execute ("INSERT INTO meta VALUES ('tokenizer', ?)", (tokenizer,))
+    elif row[0] != tokenizer:
+      raise ValueError ("The index was built with the tokenizer %s, not %s" % (row[0], tokenizer))
+
+    known = {path: (file_id, size, mtime_ns) for file_id, path, size, mtime_ns in
+             self.db.execute ("SELECT id, path, size, mtime_ns FROM files")}
+    ## The same file may be listed several times, e.g. as f and ./f
+    paths = list(dict.fromkeys (os.path.abspath (path) for path in files))
+    stats = dict()
+    with self.db:
+      for path, (file_id, size, mtime_ns) in known.items():
+        if not os.path.exists (path):
+          self._remove (file_id)
+
+      for path in paths:
+        stat = os.stat (path)
+        if path in known:
+          file_id, size, mtime_ns = known[path]
+          if (size, mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+            continue
+          self._remove (file_id)
+        stats[path] = stat
+
+      ## The new and modified files are counted at once, by a single pool
+      file_counts = count_words.count_each_file (list(stats), workers, range_size,
+                                                 chunk_size, tokenizer)
+      for path, word_counts in file_counts.items():
+        stat = stats[path]
+        file_id = self.db.execute ("INSERT INTO files (path, size, mtime_ns) VALUES (?, ?, ?)",
+                                   (path, stat.st_size, stat.st_mtime_ns)).lastrowid
+        self.db.executemany ("INSERT INTO file_words VALUES (?, ?, ?)",
+                             ((file_id, w, n) for w, n in word_counts.items()))
+        self.db.executemany ("""
+          INSERT INTO totals (word, count) VALUES (?, ?)
+          ON CONFLICT (word) DO UPDATE SET count = count + excluded.count""",
+          word_counts.items())
+    return len(file_counts)
+
+
+  def count (self, word):
+    "Number of occurrences of word"
+    row = self.db.execute ("SELECT count FROM totals WHERE word = ?", (word,)).fetchone()
+    return row[0] if row is not None else 0
+
+
+  def exactly (self, n):
+    "Words with exactly n occurrences"
+    return [w for w, in self.db.execute (
+      "SELECT word FROM totals WHERE count = ? ORDER BY word", (n,))]
+
+
+  def top (self, k):
+    "List of the k most frequent (word, count)"
+    return self.db.execute (
+      "SELECT word, count FROM totals ORDER BY count DESC, word LIMIT ?", (k,)).fetchall()
+
+
+  def group_by_count (self):
+    "Returns the list of (count, words), most frequent first"
+    groups = []
+    for w, n in self.db.execute ("SELECT word, count FROM totals ORDER BY count DESC, word"):
+      if len(groups) == 0 or groups[-1][0] != n:
+        groups.append ((n, []))
+      groups[-1][1].append (w)
+    return groups
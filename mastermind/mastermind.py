@@ -1,37 +1,256 @@
+"""
+MasterMind: guess the combination of P pegs among C colors (by default 4
+digits between 1 and 6), knowing after each attempt the number of correct
+pegs and of misplaced ones.
+
+The C^P combinations are numbered in lexicographic order, and stored as
+an array of color indices with the count of each color (see Codes), so that
+a guess is scored against a whole array of candidates at once: the correct
+pegs are the exact matches, and the misplaced ones the sum over the colors
+of the minimum of the counts in the guess and in the candidate, minus the
+correct ones. Feedbacks are encoded as n_correct * (P+1) + n_misplaced.
+For small games (at most TABLE_SIZE combinations, e.g. 6^4 = 1296), the
+feedback of every pair of combinations is precomputed in a uint8 table.
+
+The solvers choose the guess which splits the remaining candidates best:
+ - knuth: minimizes the size of the largest group of candidates left
+   (Knuth's minimax, at most 5 guesses for 4 pegs and 6 colors);
+ - expected: minimizes the expected number of candidates left.
+Beyond TABLE_SIZE combinations, the guesses and the candidates used to
+evaluate them are sampled at random.
+
+Running the module plays interactively, or with --solve-all solves all the
+combinations (or --secrets random ones) and prints the distribution of the
+number of guesses, e.g.
+  python mastermind.py --solve-all --strategy expected
+  python mastermind.py --solve-all --pegs 5 --colors 8 --secrets 100
+"""
 import numpy as np 
 
+## Characters of the colors, in the interactive game
+COLOR_CHARS = "1234567890abcdefghijklmnopqrstuvwxyz"
+
+## Largest number of combinations with a precomputed feedback table
+TABLE_SIZE = 4096
+
+
+class Codes:
+  """
+  All the combinations of pegs among n_colors colors: digits is the array
+  of shape (n_codes, pegs) of the color indices, and counts the array of
+  shape (n_codes, n_colors) of the number of pegs of each color
+  """
+  def __init__ (self, pegs = 4, n_colors = 6):
+    if (pegs + 1) ** 2 > 256 or n_colors > len(COLOR_CHARS):
+      raise ValueError ("Unsupported game with %d pegs and %d colors" % (pegs, n_colors))
+    self.pegs = pegs
+    self.n_colors = n_colors
+    self.colors = COLOR_CHARS[:n_colors]
+    self.digits = np.indices ((n_colors,) * pegs, dtype=np.uint8).reshape((pegs, -1)).T.copy()
+    self.counts = np.stack ([(self.digits == c).sum(axis=1, dtype=np.uint8)
+                             for c in range(n_colors)], axis=1)
+    self._table = None
+
+  def __len__ (self):
+    return len(self.digits)
+
+  def index (self, combination):
+    "Index of a combination (string)"
+    index = 0
+    for char in combination:
+      index = index * self.n_colors + self.colors.index (char)
+    return index
+
+  def string (self, index):
+    "Combination (string) of an index"
+    return "".join (self.colors[c] for c in self.digits[index])
+
+  def score (self, guess, candidates = None):
+    """
+    Feedbacks of the guess (index) against the candidates (array of
+    indices, all the combinations by default), as a uint8 array
+    """
+    digits, counts = self.digits, self.counts
+    if candidates is not None:
+      digits, counts = digits[candidates], counts[candidates]
+    correct = (digits == self.digits[guess]).sum(axis=1, dtype=np.uint8)
+    common = np.minimum (counts, self.counts[guess]).sum(axis=1, dtype=np.uint8)
+    return correct * np.uint8(self.pegs + 1) + common - correct
+
+  def table (self):
+    "Table of the feedbacks of all the pairs of combinations, computed on first use"
+    if self._table is None:
+      if len(self) > TABLE_SIZE:
+        raise ValueError ("Too many combinations (%d) for a feedback table" % len(self))
+      self._table = np.stack ([self.score (guess) for guess in range(len(self))])
+    return self._table
+
+  def feedback (self, guess, secret):
+    "Numbers of correct and misplaced pegs of the guess (index) for the secret"
+    if len(self) <= TABLE_SIZE:
+      value = self.table()[guess, secret]
+    else:
+      value = self.score (guess, np.array([secret]))[0]
+    return divmod (int(value), self.pegs + 1)
+
+
+_CODES_ = dict()
+
+def get_codes (pegs = 4, n_colors = 6):
+  "Codes of a game, built once per size"
+  if (pegs, n_colors) not in _CODES_:
+    _CODES_[(pegs, n_colors)] = Codes (pegs, n_colors)
+  return _CODES_[(pegs, n_colors)]
+
+
 class MasterMind:
-  def __init__ (self, combination):
+  def __init__ (self, combination, pegs = 4, n_colors = 6):
+    self.codes = get_codes (pegs, n_colors)
     self.combination = combination  
     if self.validate(combination) == False:
-      raise ValueError ("Invalid combiniation %s" % str(combiniation)) 
+      raise ValueError ("Invalid combination %s" % str(combination))
 
   def guess (self, test):
     if self.validate(test) == False: return None, None 
-    mp1, mp2 = self.remove_correct (test, self.combination)
-    return len(test)-len(mp1), len([c for c in mp1 if c in mp2])
-
-  @staticmethod
-  def remove_correct (test, right):
-    mp1 = ''.join([x for x,y in zip(test,right) if x != y])
-    mp2 = ''.join([y for x,y in zip(test,right) if x != y])
-    return mp1, mp2
-    
-
-  @staticmethod
-  def validate (combination):
-    if len(combination) != 4:
+    return self.codes.feedback (self.codes.index (test), self.codes.index (self.combination))
+
+  def validate (self, combination):
+    if len(combination) != self.codes.pegs:
       print ("Wrong length")
       return False
 
     for char in combination:
-      if char not in "123456":
+      if char not in self.codes.colors:
         print ("Wrong character %s" % str(char))
         return False
 
 
+class Solver:
+  """
+  Solver choosing each guess with the strategy 'knuth' (minimax) or
+  'expected' (expected size), among the candidates still compatible with
+  the feedbacks received. The candidates are kept as an array of indices,
+  filtered in place after each feedback.
+  Beyond TABLE_SIZE combinations, sample_guesses guesses are evaluated
+  against sample_candidates candidates drawn at random.
+  """
+  def __init__ (self, strategy = 'knuth', pegs = 4, n_colors = 6,
+                sample_guesses = 200, sample_candidates = 2000, rng = None):
+    if strategy not in ('knuth', 'expected'):
+      raise ValueError ("Unknown strategy %s" % strategy)
+    self.strategy = strategy
+    self.codes = get_codes (pegs, n_colors)
+    self.sample_guesses = sample_guesses
+    self.sample_candidates = sample_candidates
+    self.rng = rng if rng is not None else np.random.default_rng()
+    self._candidates = np.arange (len(self.codes), dtype=np.int64)
+    self.n_candidates = len(self.codes)
+    self.n_guesses = 0
+
+  @property
+  def candidates (self):
+    "Indices of the combinations compatible with the feedbacks received"
+    return self._candidates[:self.n_candidates]
+
+  def first_guess (self):
+    "Two pegs of each color, in Knuth's style: 1122 for 4 pegs"
+    colors = [min(i // 2, self.codes.n_colors - 1) for i in range(self.codes.pegs)]
+    return self.codes.index ("".join (self.codes.colors[c] for c in colors))
+
+  def _cost (self, sizes, n):
+    "Cost of each guess from the sizes of the groups of candidates it leaves"
+    if self.strategy == 'knuth':
+      return sizes.max(axis=1).astype(np.float64)
+    return (sizes.astype(np.float64) ** 2).sum(axis=1) / n
+
+  def next_guess (self):
+    "Index of the next guess"
+    if self.n_guesses == 0:
+      return self.first_guess()
+    candidates = self.candidates
+    if len(candidates) <= 2:
+      return int(candidates[0])
+
+    n_feedbacks = (self.codes.pegs + 1) ** 2
+    if len(self.codes) <= TABLE_SIZE:
+      ## The table is symmetric: rows of the candidates, columns of the guesses
+      guesses = np.arange (len(self.codes))
+      feedbacks = self.codes.table()[candidates].astype(np.int64).T
+    else:
+      guesses = np.union1d (
+        self.rng.choice (candidates, min(len(candidates), self.sample_guesses // 2), replace=False),
+        self.rng.choice (len(self.codes), self.sample_guesses // 2, replace=False))
+      sample = candidates
+      if len(candidates) > self.sample_candidates:
+        sample = self.rng.choice (candidates, self.sample_candidates, replace=False)
+      feedbacks = np.stack ([self.codes.score (g, sample) for g in guesses]).astype(np.int64)
+
+    ## Sizes of the groups of candidates left by each guess, per feedback
+    feedbacks += n_feedbacks * np.arange (len(guesses))[:, None]
+    sizes = np.bincount (feedbacks.ravel(order='K'), minlength = len(guesses) * n_feedbacks)
+    cost = self._cost (sizes.reshape ((len(guesses), n_feedbacks)), feedbacks.shape[1])
+
+    ## Among the best guesses, prefer the possible solutions, then the lowest index
+    best = guesses[cost == cost.min()]
+    possible = np.intersect1d (best, candidates)
+    return int(possible[0] if len(possible) > 0 else best[0])
+
+  def update (self, guess, feedback):
+    "Keeps the candidates giving the feedback (encoded) received for the guess"
+    self.n_guesses += 1
+    candidates = self.candidates
+    if len(self.codes) <= TABLE_SIZE:
+      keep = self.codes.table()[guess, candidates] == feedback
+    else:
+      keep = self.codes.score (guess, candidates) == feedback
+    self.n_candidates = int(np.count_nonzero (keep))
+    self._candidates[:self.n_candidates] = candidates[keep]
+
+
+def solve (secret, strategy = 'knuth', pegs = 4, n_colors = 6, rng = None):
+  "List of the guesses (indices) of the solver until it finds the secret (index)"
+  solver = Solver (strategy, pegs, n_colors, rng = rng)
+  codes = solver.codes
+  guesses = []
+  while len(guesses) == 0 or guesses[-1] != secret:
+    guess = solver.next_guess()
+    guesses.append (guess)
+    n_correct, n_misplaced = codes.feedback (guess, secret)
+    solver.update (guess, n_correct * (codes.pegs + 1) + n_misplaced)
+  return guesses
+
+
 if __name__ == '__main__':
-  mmind = MasterMind("%d%d%d%d"%tuple(np.random.randint(1,7,4)))
+  import time
+  import argparse
+  parser = argparse.ArgumentParser()
+  parser.add_argument ("-p", "--pegs", default = 4, type = int)
+  parser.add_argument ("-c", "--colors", default = 6, type = int)
+  parser.add_argument ("--solve-all", action = 'store_true',
+      help = "Solve the combinations and print the number of guesses")
+  parser.add_argument ("--secrets", default = 0, type = int,
+      help = "Solve only this many random combinations (0: all)")
+  parser.add_argument ("--strategy", default = "knuth", choices = ['knuth', 'expected'])
+  parser.add_argument ("--seed", default = None, type = int)
+  cfg = parser.parse_args()
+  codes = get_codes (cfg.pegs, cfg.colors)
+  rng = np.random.default_rng (cfg.seed)
+
+  if cfg.solve_all:
+    secrets = np.arange (len(codes))
+    if 0 < cfg.secrets < len(codes):
+      secrets = rng.choice (len(codes), cfg.secrets, replace=False)
+    start = time.perf_counter()
+    n_guesses = np.array ([len(solve (secret, cfg.strategy, cfg.pegs, cfg.colors, rng))
+                           for secret in secrets])
+    elapsed = time.perf_counter() - start
+    for n, count in enumerate (np.bincount (n_guesses)):
+      if count > 0:
+        print ("%d guesses: %4d" % (n, count))
+    print ("Mean: %.4f  Max: %d  Time: %.2f s" % (n_guesses.mean(), n_guesses.max(), elapsed))
+    exit()
+
+  mmind = MasterMind(codes.string (rng.integers (len(codes))), cfg.pegs, cfg.colors)
   for iAttempt in range(8):
     n_ok, n_misplaced = None, None
     while n_ok == None: 
@@ -42,6 +261,5 @@ if __name__ == '__main__':
       break 
     else:
       print ("nCorrect: %d   nMisplaced: %d" % (n_ok, n_misplaced))
-      exit()
-
-  print ("You lose... :( Solution:", mmind.combination)
+  else:
+    print ("You lose... :( Solution:", mmind.combination)
@@ -0,0 +1,200 @@
+"""
+Bitboard
+--------
+
+Compact representation of a reversi board side as a 64-bit integer.
+The cell (i,j) of the 8x8 numpy boards used by reversi.Game is mapped
+onto the bit i*8+j.
+
+Valid moves and flipped tokens are obtained by shifting the whole board
+in the 8 directions at once (shift-and-mask propagation), instead of
+stepping through the cells one by one.
+https://www.chessprogramming.org/Dumb7Fill
+"""
+import numpy as np
+
+FULL = 0xFFFFFFFFFFFFFFFF
+NOT_J0 = 0xFEFEFEFEFEFEFEFE  ## all the cells except those with j == 0
+NOT_J7 = 0x7F7F7F7F7F7F7F7F  ## all the cells except those with j == 7
+
+## Regions of the board: the 4 corners, the other cells of the borders and
+## the inner cells, as used to weight or order the moves
+CORNERS = 0x8100000000000081
+BORDERS = 0xFF818181818181FF & ~CORNERS
+INNER = FULL & ~(CORNERS | BORDERS)
+
+## Each direction is defined by the shift of the bit index, and by the mask
+## removing the cells wrapped around the board edge by the shift
+DIRECTIONS = (
+  ( 8, FULL  ),    # ( 1,  0)
+  ( 1, NOT_J0),    # ( 0,  1)
+  (-8, FULL  ),    # (-1,  0)
+  (-1, NOT_J7),    # ( 0, -1)
+  ( 9, NOT_J0),    # ( 1,  1)
+  ( 7, NOT_J7),    # ( 1, -1)
+  (-7, NOT_J0),    # (-1,  1)
+  (-9, NOT_J7),    # (-1, -1)
+)
+
+
+def shift (bits, n, mask):
+  "Shift all the tokens by n cells, dropping those falling off the board"
+  if n > 0:
+    return (bits << n) & mask & FULL
+  return (bits >> -n) & mask
+
+
+def valid_moves (player, opponent):
+  """
+  Returns the mask of the empty cells where the player can place a token,
+  reversing at least one of the opponent's tokens.
+  """
+  empty = ~(player | opponent) & FULL
+  moves = 0
+  ## shift() is unrolled here, as this is the hottest loop of the engine
+  for n, mask in DIRECTIONS:
+    om = opponent & mask
+    if n > 0:
+      x = (player << n) & om
+      x |= (x << n) & om
+      x |= (x << n) & om
+      x |= (x << n) & om
+      x |= (x << n) & om
+      x |= (x << n) & om
+      moves |= (x << n) & empty & mask
+    else:
+      n = -n
+      x = (player >> n) & om
+      x |= (x >> n) & om
+      x |= (x >> n) & om
+      x |= (x >> n) & om
+      x |= (x >> n) & om
+      x |= (x >> n) & om
+      moves |= (x >> n) & empty & mask
+  return moves
+
+
+def flips (player, opponent, move):
+  """
+  Returns the mask of the opponent's tokens reversed by placing a token
+  of the player on the single-bit mask move.
+  """
+  flipped = 0
+  for n, mask in DIRECTIONS:
+    line = 0
+    x = shift (move, n, mask) & opponent
+    while x:
+      line |= x
+      x = shift (x, n, mask)
+      if x & player:
+        flipped |= line
+        break
+      x &= opponent
+  return flipped
+
+
+def play (player, opponent, move):
+  """
+  Applies the move (single-bit mask) of the player and returns the
+  updated (player, opponent) pair
+  """
+  f = flips (player, opponent, move)
+  return player | move | f, opponent & ~f
+
+
+def count (bits):
+  "Number of tokens on the board"
+  return bin(bits).count("1")
+
+
+def iter_bits (bits):
+  "Iterates over the single-bit masks composing bits, lowest index first"
+  while bits:
+    lsb = bits & -bits
+    yield lsb
+    bits ^= lsb
+
+
+def bit2cell (bit):
+  "Convert a single-bit mask into the (i,j) cell coordinates"
+  return divmod (bit.bit_length()-1, 8)
+
+
+def cell2bit (cell):
+  "Convert the (i,j) cell coordinates into a single-bit mask"
+  i, j = cell
+  return 1 << (int(i)*8 + int(j))
+
+
+def mask2cells (bits):
+  "Convert a mask into the list of (i,j) cells, in the row-major order"
+  return [bit2cell(b) for b in iter_bits(bits)]
+
+
+################################################################################
+## Symmetries of the board
+## https://www.chessprogramming.org/Flipping_Mirroring_and_Rotating
+def flip_i (bits):
+  "Mirror the board as board[::-1] (i -> 7-i)"
+  return int.from_bytes (bits.to_bytes(8, 'little'), 'big')
+
+
+def flip_j (bits):
+  "Mirror the board as board[:,::-1] (j -> 7-j)"
+  bits = ((bits >> 1) & 0x5555555555555555) | ((bits & 0x5555555555555555) << 1)
+  bits = ((bits >> 2) & 0x3333333333333333) | ((bits & 0x3333333333333333) << 2)
+  bits = ((bits >> 4) & 0x0F0F0F0F0F0F0F0F) | ((bits & 0x0F0F0F0F0F0F0F0F) << 4)
+  return bits
+
+
+def transpose (bits):
+  "Mirror the board as board.T (i <-> j)"
+  t = 0x0F0F0F0F00000000 & (bits ^ (bits << 28))
+  bits ^= t ^ (t >> 28)
+  t = 0x3333000033330000 & (bits ^ (bits << 14))
+  bits ^= t ^ (t >> 14)
+  t = 0x5500550055005500 & (bits ^ (bits << 7))
+  bits ^= t ^ (t >> 7)
+  return bits
+
+
+## The 8 symmetries of the board, in the same order as the augmentation of
+## NeuralNetwork_agent: board, board[::-1], board[:,::-1], board[::-1,::-1],
+## and the same on board.T. INVERSE_SYMMETRIES[k] undoes SYMMETRIES[k].
+SYMMETRIES = (
+  lambda b: b,
+  flip_i,
+  flip_j,
+  lambda b: flip_i(flip_j(b)),
+  transpose,
+  lambda b: flip_i(transpose(b)),
+  lambda b: flip_j(transpose(b)),
+  lambda b: flip_i(flip_j(transpose(b))),
+)
+
+INVERSE_SYMMETRIES = SYMMETRIES[:5] + (
+  lambda b: transpose(flip_i(b)),
+  lambda b: transpose(flip_j(b)),
+  lambda b: transpose(flip_i(flip_j(b))),
+)
+
+
+################################################################################
+## Adapter from/to the numpy boards used by reversi.Game
+def from_array (board):
+  "Convert an 8x8 numpy board into a bitboard"
+  packed = np.packbits (np.asarray(board).reshape(-1) > 0, bitorder='little')
+  return int (packed.view('<u8')[0])
+
+
+def to_array (bits, dtype=np.float32):
+  "Convert a bitboard into an 8x8 numpy board"
+  raw = np.array ([bits], dtype='<u8').view(np.uint8)
+  return np.unpackbits (raw, bitorder='little').reshape(8,8).astype(dtype)
+
+
+def to_arrays (bits, dtype=np.float32):
+  "Convert a sequence of bitboards into an array of 8x8 numpy boards"
+  raw = np.asarray (bits, dtype='<u8')
+  unpacked = np.unpackbits (raw.reshape(-1).view(np.uint8), bitorder='little')
+  return unpacked.reshape(raw.shape + (8,8)).astype(dtype)
@@ -0,0 +1,156 @@
+"""
+Opening book
+------------
+
+Statistics of the moves played in the first plies of many games (e.g.
+self-play or match runs), used to play the openings without searching.
+For each position, identified by the hash of its canonical form (see
+transposition.canonical), the book stores the number of times each move
+was played and the sum of the final disc differentials for the player who
+moved. Symmetric openings thus share their statistics.
+
+On disk, the book is a compressed .npz file with one row per (position,
+move) pair: the 64-bit hash, the cell of the move in the canonical frame,
+the number of samples and the sum of the differentials. In memory, it is
+a dictionary of dictionaries, looked up in constant time.
+
+The book plays the move with the best mean differential among the moves
+with at least min_samples samples, and only in the first depth plies.
+"""
+import os
+import numpy as np
+
+import bitboard
+import transposition
+
+## Initial position of rules.Game
+INITIAL_WHITE = (1 << 27) | (1 << 36)
+INITIAL_BLACK = (1 << 28) | (1 << 35)
+
+
+def npz_path (path):
+  "Path of the book file, with the .npz suffix that numpy.savez appends"
+  return path if path.endswith (".npz") else path + ".npz"
+
+
+class OpeningBook:
+  """
+  Move statistics of the first depth plies of the recorded games. Moves
+  with less than min_samples samples are never played.
+  """
+  def __init__ (self, depth=12, min_samples=8):
+    self.depth = depth
+    self.min_samples = min_samples
+    ## canonical hash -> {canonical move: [samples, sum of differentials]}
+    self.positions = dict()
+
+
+  def __len__ (self):
+    return len(self.positions)
+
+
+  def record (self, moves, n_white, n_black):
+    """
+    Adds the first depth moves of a game, given as the sequence of (side,
+    white, black) bitboards after each move (see rules.Game.history), and
+    the final number of white and black tokens
+    """
+    white, black = INITIAL_WHITE, INITIAL_BLACK
+    for side, w, b in moves[:self.depth]:
+      if side == 'white':
+        player, opponent, diff = white, black, n_white - n_black
+        move = w & ~(white | black)
+      else:
+        player, opponent, diff = black, white, n_black - n_white
+        move = b & ~(white | black)
+
+      h, k, _, _ = transposition.canonical (player, opponent)
+      stats = self.positions.setdefault (h, dict()).setdefault (
+          bitboard.SYMMETRIES[k](move), [0, 0])
+      stats[0] += 1
+      stats[1] += diff
+      white, black = w, b
+
+
+  def record_game (self, game):
+    "Adds the first depth moves of a finished rules.Game"
+    moves = [(side, bitboard.from_array(w), bitboard.from_array(b))
+             for side, w, b in game.history]
+    self.record (moves, np.count_nonzero (game.white), np.count_nonzero (game.black))
+
+
+  def lookup (self, player, opponent):
+    """
+    Best move of the book (single-bit mask) for the position defined by two
+    bitboards, with the player to move, or None if the position is not in
+    the book, too deep, or its moves have too few samples
+    """
+    if bitboard.count (player | opponent) - 4 >= self.depth:
+      return None
+    h, k, _, _ = transposition.canonical (player, opponent)
+    moves = self.positions.get (h)
+    if moves is None:
+      return None
+
+    best, best_mean = None, None
+    for move, (n, total) in moves.items():
+      if n >= self.min_samples and (best is None or total / n > best_mean):
+        best, best_mean = move, total / n
+    if best is None:
+      return None
+    return bitboard.INVERSE_SYMMETRIES[k](best)
+
+
+  def save (self, path):
+    "Writes the book to the .npz file path (suffixed with .npz if needed)"
+    rows = [(h, move.bit_length() - 1, n, total)
+            for h, moves in self.positions.items()
+            for move, (n, total) in moves.items()]
+    keys, cells, samples, totals = zip(*rows) if len(rows) else ([], [], [], [])
+    np.savez_compressed (npz_path (path),
+      depth = self.depth,
+      keys = np.array (keys, dtype=np.uint64),
+      cells = np.array (cells, dtype=np.uint8),
+      samples = np.array (samples, dtype=np.uint32),
+      totals = np.array (totals, dtype=np.int32),
+    )
+
+
+  @staticmethod
+  def load (path, depth=None, min_samples=8):
+    """
+    Reads the book from the .npz file path, played up to depth plies
+    (by default, the depth used to record it)
+    """
+    with np.load (npz_path (path)) as f:
+      book = OpeningBook (int(f['depth']) if depth is None else depth, min_samples)
+      for h, cell, n, total in zip (f['keys'].tolist(), f['cells'].tolist(),
+                                    f['samples'].tolist(), f['totals'].tolist()):
+        book.positions.setdefault (h, dict())[1 << cell] = [n, total]
+    return book
+
+
+  @staticmethod
+  def open (path, depth=12, min_samples=8):
+    "Loads the book from path if it exists, otherwise returns an empty book"
+    if os.path.exists (npz_path (path)):
+      return OpeningBook.load (path, depth, min_samples)
+    return OpeningBook (depth, min_samples)
+
+
+class BookAgent:
+  """
+  Agent playing the move of the opening book when there is one, and as the
+  fallback agent otherwise
+  """
+  def __init__ (self, book, fallback):
+    self.book = book
+    self.fallback = fallback
+
+
+  def __call__ (self, game, player, opponent):
+    move = self.book.lookup (bitboard.from_array (player), bitboard.from_array (opponent))
+    if move is None:
+      return self.fallback (game, player, opponent)
+
+    return game.move_index (player, opponent, move)
@@ -0,0 +1,181 @@
+"""
+Endgame solver
+--------------
+
+Near the end of the game the tree of the remaining moves is small enough
+to be searched exhaustively: the solver finds the perfect-play final disc
+differential with an alpha-beta negamax search on the bitboards.
+https://www.chessprogramming.org/Endgame
+
+Moves after the first one are searched with a null window (principal
+variation search), and are searched again only if they prove better.
+Moves are ordered to obtain cutoffs early:
+ - mobility: moves leaving the opponent with fewer options come first
+   (fastest-first), with the corners first among equal mobilities;
+ - parity: moves in the quadrants with an odd number of empty cells come
+   first, as the player moving last in a region takes its last tokens.
+Close to the end, ordering costs more than it saves, and only parity is used.
+
+Running this module solves random positions with a given number of empty
+cells, reporting the disc differential and the nodes per second, e.g.
+  python endgame.py --empties 12 --positions 5
+"""
+import time
+import numpy as np
+
+import bitboard
+
+QUADRANTS = (
+  0x000000000F0F0F0F,   ## i < 4, j < 4
+  0x00000000F0F0F0F0,   ## i < 4, j >= 4
+  0x0F0F0F0F00000000,   ## i >= 4, j < 4
+  0xF0F0F0F000000000,   ## i >= 4, j >= 4
+)
+
+## Below this number of empty cells, only the parity ordering is applied
+MOBILITY_ORDERING_EMPTIES = 5
+
+
+class EndgameSolver:
+  """
+  Exact solver. The statistics of the last call to solve are stored in the
+  attribute last.
+  """
+  def __init__ (self):
+    self.nodes = 0
+    self.last = None
+
+
+  def solve (self, player, opponent):
+    """
+    Solves the position defined by two bitboards, with the player to move.
+    Returns the final disc differential for the player under perfect play,
+    and the single-bit mask of the best move (None if the player must pass)
+    """
+    start = time.perf_counter()
+    self.nodes = 0
+    best_value, best_move = -65, None
+    moves = bitboard.valid_moves (player, opponent)
+    if moves == 0:
+      best_value = self._search (player, opponent, -64, 64)
+    else:
+      alpha = -64
+      for move in self._ordered (player, opponent, moves):
+        p, o = bitboard.play (player, opponent, move)
+        value = -self._search (o, p, -64, -alpha)
+        if value > best_value:
+          best_value, best_move = value, move
+          alpha = max(alpha, value)
+
+    elapsed = time.perf_counter() - start
+    self.last = dict(
+      empties = 64 - bitboard.count (player | opponent),
+      value = best_value,
+      nodes = self.nodes,
+      ms = elapsed * 1e3,
+      nps = self.nodes / elapsed if elapsed > 0 else float('inf'),
+    )
+    return best_value, best_move
+
+
+  def _ordered (self, player, opponent, moves):
+    "Moves sorted by mobility of the opponent, corners and parity"
+    empty = ~(player | opponent) & bitboard.FULL
+    odd = 0
+    for quadrant in QUADRANTS:
+      if bitboard.count (empty & quadrant) & 1:
+        odd |= quadrant
+
+    if bitboard.count (empty) < MOBILITY_ORDERING_EMPTIES:
+      return ( list(bitboard.iter_bits (moves & odd))
+             + list(bitboard.iter_bits (moves & ~odd)) )
+
+    keys = []
+    for move in bitboard.iter_bits (moves):
+      p, o = bitboard.play (player, opponent, move)
+      mobility = bitboard.count (bitboard.valid_moves (o, p))
+      keys.append ((mobility, not (move & bitboard.CORNERS), not (move & odd), move))
+    keys.sort()
+    return [k[-1] for k in keys]
+
+
+  def _search (self, player, opponent, alpha, beta, passed=False):
+    "Final disc differential for the player to move, within (alpha, beta)"
+    self.nodes += 1
+    moves = bitboard.valid_moves (player, opponent)
+    if moves == 0:
+      if passed:
+        return bitboard.count (player) - bitboard.count (opponent)
+      return -self._search (opponent, player, -beta, -alpha, True)
+
+    best = -65
+    for move in self._ordered (player, opponent, moves):
+      p, o = bitboard.play (player, opponent, move)
+      if (p | o) == bitboard.FULL:
+        value = bitboard.count (p) - bitboard.count (o)
+      elif best == -65:
+        value = -self._search (o, p, -beta, -alpha)
+      else:
+        ## Principal variation search: a null window proves the move worse
+        value = -self._search (o, p, -alpha-1, -alpha)
+        if alpha < value < beta:
+          value = -self._search (o, p, -beta, -value)
+      if value > best:
+        best = value
+        if value > alpha:
+          alpha = value
+          if alpha >= beta:
+            break
+    return best
+
+
+class EndgameAgent:
+  """
+  Agent handing over to the endgame solver when the number of empty cells
+  is not larger than empties, and playing as the fallback agent otherwise
+  """
+  def __init__ (self, fallback, empties=12):
+    self.fallback = fallback
+    self.empties = empties
+    self.solver = EndgameSolver()
+
+
+  def __call__ (self, game, player, opponent):
+    p, o = bitboard.from_array(player), bitboard.from_array(opponent)
+    if 64 - bitboard.count (p | o) > self.empties:
+      return self.fallback (game, player, opponent)
+
+    value, move = self.solver.solve (p, o)
+    return game.move_index (player, opponent, move)
+
+
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser()
+  parser.add_argument ("-e", "--empties", default = 12, type = int)
+  parser.add_argument ("-n", "--positions", default = 5, type = int)
+  parser.add_argument ("-s", "--seed", default = 1, type = int)
+  cfg = parser.parse_args()
+
+  rng = np.random.default_rng (cfg.seed)
+  solver = EndgameSolver()
+  iPosition = 0
+  while iPosition < cfg.positions:
+    ## Random game up to the requested number of empty cells
+    p, o = 0x0000000810000000, 0x0000001008000000
+    while 64 - bitboard.count (p | o) > cfg.empties:
+      moves = list(bitboard.iter_bits (bitboard.valid_moves (p, o)))
+      if len(moves) > 0:
+        p, o = bitboard.play (p, o, moves[rng.integers(len(moves))])
+      elif bitboard.valid_moves (o, p) == 0:
+        break
+      p, o = o, p
+
+    if 64 - bitboard.count (p | o) != cfg.empties:
+      continue
+
+    solver.solve (p, o)
+    print ("%(empties)2d empties: %(value)+3d discs  %(nodes)9d nodes  "
+           "%(ms)9.1f ms  %(nps)9.0f nodes/s" % solver.last)
+    iPosition += 1
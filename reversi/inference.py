@@ -0,0 +1,130 @@
+"""
+Inference server
+----------------
+
+Batching of the network evaluations requested by games running
+concurrently in the same process (e.g. GameAi threads, see
+match.run_match with threads > 1). The requests are queued and a single
+thread scores them with the network, in one forward pass per batch: the
+batch is flushed as soon as it holds max_batch positions, or when
+max_delay_ms milliseconds have passed since its first request.
+Each request receives its scores through a concurrent.futures.Future.
+
+The server exposes score_positions, so that it can replace the network
+of the agents and evaluators relying on it (see BatchedAgent and
+search.NetworkEvaluator).
+"""
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import numpy as np
+
+
+class InferenceServer:
+  """
+  Thread scoring the positions requested with submit (or score_positions)
+  with network.score_positions, in batches of up to max_batch positions.
+  The number of batches and of positions scored are counted in stats().
+  """
+  def __init__ (self, network, max_batch=256, max_delay_ms=2.):
+    self.network = network
+    self.max_batch = max_batch
+    self.max_delay_ms = max_delay_ms
+    self.n_batches = 0
+    self.n_positions = 0
+    self._requests = queue.Queue()
+    self._thread = threading.Thread (target=self._serve, daemon=True)
+    self._thread.start()
+
+
+  def submit (self, batch):
+    """
+    Requests the scores of a batch of flattened (player, opponent)
+    positions. Returns a Future of the array of shape (n_positions,)
+    """
+    future = Future()
+    batch = np.asarray (batch, dtype=np.float32).reshape((-1, 8*8*2))
+    self._requests.put ((batch, future))
+    return future
+
+
+  def score_positions (self, batch):
+    "Scores a batch of positions, waiting for the flush of the server"
+    return self.submit (batch).result()
+
+
+  def _collect (self):
+    """
+    Waits for a first request, then gathers the following ones until the
+    batch is full or the deadline is passed. Returns None on close.
+    """
+    first = self._requests.get()
+    if first is None: return None
+    requests = [first]
+    size = len(first[0])
+    deadline = time.perf_counter() + self.max_delay_ms * 1e-3
+    while size < self.max_batch:
+      timeout = deadline - time.perf_counter()
+      if timeout <= 0: break
+      try:
+        request = self._requests.get (timeout=timeout)
+      except queue.Empty:
+        break
+      if request is None:
+        self._requests.put (None)  ## served after the pending requests
+        break
+      requests.append (request)
+      size += len(request[0])
+    return requests
+
+
+  def _serve (self):
+    while True:
+      requests = self._collect()
+      if requests is None: return
+
+      batches = [batch for batch, _ in requests]
+      try:
+        scores = np.asarray (self.network.score_positions (np.concatenate (batches))).reshape(-1)
+      except Exception as error:
+        for _, future in requests:
+          future.set_exception (error)
+        continue
+
+      self.n_batches += 1
+      self.n_positions += len(scores)
+      offsets = np.cumsum ([0] + [len(b) for b in batches])
+      for (_, future), begin, end in zip(requests, offsets[:-1], offsets[1:]):
+        future.set_result (scores[begin:end])
+
+
+  def stats (self):
+    "Number of batches and of positions scored, and mean batch size"
+    return dict(batches = self.n_batches, positions = self.n_positions,
+                mean_batch = self.n_positions / self.n_batches if self.n_batches else 0.)
+
+
+  def close (self):
+    "Stops the server thread, once the pending requests are served"
+    self._requests.put (None)
+    self._thread.join()
+
+
+class BatchedAgent:
+  """
+  Agent choosing the move with the highest score, as obtained from the
+  inference server. Exposes score_positions, like the network agents.
+  """
+  def __init__ (self, server):
+    self.server = server
+
+
+  def score_positions (self, batch):
+    return self.server.score_positions (batch)
+
+
+  def __call__ (self, game, player, opponent):
+    moves, outcomes = game.successors(player, opponent)
+    scores = self.score_positions (outcomes.reshape((len(moves), -1)))
+    return int(np.argmax (scores))
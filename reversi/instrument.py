@@ -0,0 +1,156 @@
+"""
+Instrumentation
+---------------
+
+Timing of the game flow: call counts, cumulative time and percentiles of
+Game.run, _start_turn (legal moves of each turn), list_valid_move,
+move_outcome, check_valid and of the agents (white_moves, black_moves),
+per function and per player. The percentiles are read from histograms
+with logarithmic bins (about 6% wide), so that the memory and the cost of
+a summary do not grow with the number of games.
+
+The profiler is installed on a game instance by wrapping its methods, so
+that games without profiler run exactly the original code and pay nothing.
+At the end of each game, the statistics accumulated over all the games
+instrumented by the profiler are written as a JSON summary and/or as a
+collapsed-stack file, with the exclusive time in microseconds of each call
+stack, readable by flamegraph.pl or speedscope, e.g.
+  python reversi-ia.py -w alphabeta -b tactics -n 10 --profile-collapsed out.txt
+  flamegraph.pl out.txt > out.svg
+"""
+import math
+import time
+import json
+import threading
+import numpy as np
+
+## Methods of rules.Game timed by the profiler
+FUNCTIONS = ('run', '_start_turn', 'list_valid_move', 'move_outcome',
+             'check_valid', 'white_moves', 'black_moves')
+
+## Histogram bins of the durations: BINS_PER_DECADE per decade from 0.1 us
+BINS_PER_DECADE = 40
+N_BINS = 9 * BINS_PER_DECADE
+
+
+class Timing:
+  "Number of calls, total and maximum time, and histogram of the durations"
+  __slots__ = ('calls', 'total', 'max', 'bins')
+
+  def __init__ (self):
+    self.calls = 0
+    self.total = 0.
+    self.max = 0.
+    self.bins = [0] * N_BINS
+
+  def add (self, elapsed):
+    self.calls += 1
+    self.total += elapsed
+    self.max = max(self.max, elapsed)
+    k = int(BINS_PER_DECADE * (math.log10 (elapsed) + 7)) if elapsed > 1e-7 else 0
+    self.bins[min(max(k, 0), N_BINS - 1)] += 1
+
+  def percentiles (self, qs):
+    "Durations (upper edge of their bin, at most max) of the percentiles qs"
+    cumulative = np.cumsum (self.bins)
+    ks = np.searchsorted (cumulative, np.array (qs) / 100. * self.calls)
+    return np.minimum (10. ** ((ks + 1) / BINS_PER_DECADE - 7), self.max)
+
+
+class Profiler:
+  """
+  Collects the timings of the games it is installed on (see install), and
+  writes them to json_path and collapsed_path, if defined, at game end
+  """
+  def __init__ (self, json_path=None, collapsed_path=None):
+    self.json_path = json_path
+    self.collapsed_path = collapsed_path
+    self._lock = threading.Lock()
+    self._local = threading.local()
+    ## (function, player) -> Timing of the calls, in seconds
+    self.timings = dict()
+    ## call stack -> exclusive time in seconds
+    self.stacks = dict()
+
+
+  def install (self, game):
+    "Wraps the methods of FUNCTIONS of the game instance. Returns the game"
+    for name in FUNCTIONS:
+      setattr (game, name, self._wrap (game, name, getattr (game, name)))
+    return game
+
+
+  def _player (self, game, name, args):
+    "Player on whose behalf the function is called"
+    state = self._local
+    if name in ('white_moves', 'black_moves'):
+      state.side = name.split('_')[0]
+    elif name == 'check_valid':
+      state.side = args[4]
+    elif name in ('_start_turn', 'list_valid_move') and len(args) > 0:
+      if args[0] is game.white: return 'white'
+      if args[0] is game.black: return 'black'
+    elif name == 'run':
+      return 'game'
+    return getattr (state, 'side', 'game')
+
+
+  def _wrap (self, game, name, method):
+    profiler = self
+    def timed (*args, **kwargs):
+      state = profiler._local
+      if not hasattr (state, 'stack'):
+        state.stack, state.children = [], [0.]
+      player = profiler._player (game, name, args)
+      state.stack.append (name)
+      state.children.append (0.)
+      start = time.perf_counter()
+      try:
+        return method (*args, **kwargs)
+      finally:
+        elapsed = time.perf_counter() - start
+        inner = state.children.pop()
+        state.children[-1] += elapsed
+        path = ";".join (state.stack)
+        state.stack.pop()
+        with profiler._lock:
+          if (name, player) not in profiler.timings:
+            profiler.timings[(name, player)] = Timing()
+          profiler.timings[(name, player)].add (elapsed)
+          profiler.stacks[path] = profiler.stacks.get (path, 0.) + elapsed - inner
+        if name == 'run':
+          profiler.dump()
+    timed.__wrapped__ = method
+    return timed
+
+
+  def summary (self):
+    """
+    Statistics per function and per player: number of calls, total time,
+    mean and percentiles of the time per call (in milliseconds)
+    """
+    ret = dict()
+    with self._lock:
+      for (name, player), t in sorted (self.timings.items()):
+        p50, p90, p99 = t.percentiles ([50, 90, 99]) * 1e3
+        ret.setdefault (name, dict())[player] = dict(calls = t.calls,
+            total_ms = t.total * 1e3, mean_ms = t.total * 1e3 / t.calls, p50 = float(p50),
+            p90 = float(p90), p99 = float(p99), max = t.max * 1e3)
+    return ret
+
+
+  def collapsed (self):
+    "Lines of the collapsed-stack format: call stack and microseconds"
+    with self._lock:
+      stacks = dict(self.stacks)
+    return ["%s %d" % (path, round (t * 1e6)) for path, t in sorted (stacks.items())]
+
+
+  def dump (self):
+    "Writes the JSON summary and the collapsed stacks to their paths"
+    if self.json_path is not None:
+      with open (self.json_path, 'w') as f:
+        json.dump (self.summary(), f, indent=2)
+    if self.collapsed_path is not None:
+      with open (self.collapsed_path, 'w') as f:
+        f.write ("\n".join (self.collapsed()) + "\n")
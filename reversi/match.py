@@ -0,0 +1,125 @@
+"""
+Match runner
+------------
+
+Plays a series of games between two agents, alternating the colors, and
+collects the statistics of the match:
+ - wins, draws and losses of the first agent;
+ - disc differential of the first agent (total and per game);
+ - per-move latency percentiles of each agent, keyed by its index and
+   name (e.g. "0:alphabeta", "1:alphabeta"), so that an agent playing
+   against itself gets the timings of both sides;
+ - games per second.
+The statistics are meant to be written to JSON, as a basis for regression
+gating of the agents (see reversi-ia.py --match).
+"""
+import time
+import json
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+class TimedAgent:
+  "Agent wrapper recording the time spent choosing each move"
+  def __init__ (self, agent):
+    self.agent = agent
+    self.latencies = []
+
+  def __call__ (self, game, player, opponent):
+    start = time.perf_counter()
+    ret = self.agent (game, player, opponent)
+    self.latencies.append (time.perf_counter() - start)
+    return ret
+
+
+def latency_summary (latencies):
+  "Summary of the latencies, in milliseconds"
+  if len(latencies) == 0:
+    return dict(moves = 0)
+  ms = np.array (latencies) * 1e3
+  p50, p90, p99 = np.percentile (ms, [50, 90, 99])
+  return dict(moves = len(ms), mean = float(ms.mean()), p50 = float(p50),
+              p90 = float(p90), p99 = float(p99), max = float(ms.max()))
+
+
+def run_match (make_game, agent_a, agent_b, n_games, names=('a', 'b'),
+               progress=None, on_game=None, threads=1, make_agents=None):
+  """
+  Plays n_games games between agent_a and agent_b, the first one playing
+  white in even games and black in odd ones. make_game(white_agent,
+  black_agent) returns a game ready to run, e.g. GameAi. If defined,
+  progress(iGame, stats) is called after each game, and on_game(game)
+  with the finished game, e.g. to record it in an opening book.
+  With threads > 1, groups of threads games are played concurrently, each
+  game running in its own thread. Agents keeping the state of their search
+  (e.g. search.NegamaxAgent) must not be shared among the threads:
+  make_agents() then returns a new (agent_a, agent_b) pair, called for each
+  thread but the first one, which plays with agent_a and agent_b. Networks
+  shared by the agents can be served by an inference.InferenceServer.
+  The exception of a failed game is raised once the group is over.
+  Returns the dictionary of the statistics.
+  """
+  pairs = [(agent_a, agent_b)]
+  for iThread in range(1, threads):
+    pairs.append (make_agents() if make_agents is not None else (agent_a, agent_b))
+  timed = [(TimedAgent (a), TimedAgent (b)) for a, b in pairs]
+  wins, draws, losses = 0, 0, 0
+  diffs = []
+  start = time.perf_counter()
+  for iFirst in range(0, n_games, threads):
+    games = []
+    for iGame, (timed_a, timed_b) in zip(range(iFirst, min(n_games, iFirst + threads)), timed):
+      games.append (make_game (timed_a, timed_b) if iGame % 2 == 0 else make_game (timed_b, timed_a))
+    if len(games) == 1:
+      games[0].run()
+    else:
+      ## Games are run by the pool, so that their exceptions are not lost
+      with ThreadPoolExecutor (len(games)) as executor:
+        futures = [executor.submit (g.run) for g in games]
+      for future in futures:
+        future.result()
+
+    for iGame, g in enumerate(games, iFirst):
+      if on_game is not None:
+        on_game (g)
+
+      nw, nb = np.count_nonzero (g.white), np.count_nonzero (g.black)
+      diff = int(nw - nb) if iGame % 2 == 0 else int(nb - nw)
+      diffs.append (diff)
+      if diff > 0: wins += 1
+      elif diff < 0: losses += 1
+      else: draws += 1
+
+      if progress is not None:
+        progress (iGame, dict(wins = wins, draws = draws, losses = losses))
+
+  elapsed = time.perf_counter() - start
+  latencies_a = [t for timed_a, _ in timed for t in timed_a.latencies]
+  latencies_b = [t for _, timed_b in timed for t in timed_b.latencies]
+  return dict(
+    agents = list(names),
+    games = n_games,
+    wins = wins,
+    draws = draws,
+    losses = losses,
+    disc_differential = dict(
+      total = int(np.sum (diffs)),
+      mean = float(np.mean (diffs)) if n_games > 0 else 0.,
+      per_game = diffs,
+    ),
+    latency_ms = {
+      "0:%s" % names[0]: latency_summary (latencies_a),
+      "1:%s" % names[1]: latency_summary (latencies_b),
+    },
+    elapsed_s = elapsed,
+    games_per_s = n_games / elapsed if elapsed > 0 else 0.,
+  )
+
+
+def write_stats (stats, path=None):
+  "Writes the statistics as JSON to path, or to the standard output"
+  if path is None:
+    print (json.dumps (stats, indent=2))
+  else:
+    with open (path, 'w') as f:
+      json.dump (stats, f, indent=2)
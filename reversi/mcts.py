@@ -0,0 +1,242 @@
+"""
+Monte-Carlo Tree Search
+-----------------------
+
+Agent growing a search tree by playing random games (playouts) from the
+current position, and choosing the move visited the most.
+https://en.wikipedia.org/wiki/Monte_Carlo_tree_search
+
+Playouts follow either the random agent or the tactics agent policy
+(borders are more appealing), on the bitboards (see bitboard.py).
+Optionally, the children of each node are given prior probabilities from
+the scores of a network exposing score_positions (NumpyNetwork_agent),
+and are selected with the PUCT formula instead of UCT.
+
+Root parallelism: with several workers, independent trees are grown from
+the same position in a pool of processes, each for the whole time budget,
+and their visit counts are summed at the end of the move.
+"""
+import math
+import time
+import random
+import multiprocessing
+
+import bitboard
+
+## Temperature of the softmax turning network scores into priors
+PRIOR_TEMPERATURE = 8.
+
+
+################################################################################
+## Playout policies: choose a move among the single-bit masks of moves
+def random_policy (moves, rnd):
+  return moves [rnd.randrange(len(moves))]
+
+
+def tactics_policy (moves, rnd):
+  weights = [4 if m & bitboard.CORNERS else 2 if m & bitboard.BORDERS else 1 for m in moves]
+  return rnd.choices (moves, weights)[0]
+
+
+POLICIES = dict(
+  random = random_policy,
+  tactics = tactics_policy,
+)
+
+
+def playout (player, opponent, policy, rnd):
+  """
+  Plays a game up to the end with the policy, from the position with the
+  player to move. Returns the final disc differential for the player.
+  """
+  sign = 1
+  passed = False
+  while True:
+    moves = bitboard.valid_moves (player, opponent)
+    if moves == 0:
+      if passed: break
+      passed = True
+    else:
+      passed = False
+      move = policy (list(bitboard.iter_bits(moves)), rnd)
+      player, opponent = bitboard.play (player, opponent, move)
+    player, opponent, sign = opponent, player, -sign
+
+  return sign * (bitboard.count (player) - bitboard.count (opponent))
+
+
+################################################################################
+## Search tree
+class Node:
+  """
+  Position of the tree, with the player to move. color is 0 if the player
+  to move is the one to move at the root, 1 otherwise. wins counts the
+  results of the playouts for the player who moved into the node.
+  """
+  __slots__ = ('player', 'opponent', 'color', 'move', 'prior', 'children',
+               'visits', 'wins')
+
+  def __init__ (self, player, opponent, color, move=None, prior=1.):
+    self.player = player
+    self.opponent = opponent
+    self.color = color
+    self.move = move
+    self.prior = prior
+    self.children = None
+    self.visits = 0
+    self.wins = 0.
+
+
+  def expand (self, network=None):
+    "Creates the children of the node (a single one with move 0 on pass)"
+    moves = list(bitboard.iter_bits (bitboard.valid_moves (self.player, self.opponent)))
+    self.children = []
+    if len(moves) == 0:
+      if bitboard.valid_moves (self.opponent, self.player) != 0:
+        self.children.append (Node (self.opponent, self.player, 1 - self.color, 0))
+      return
+
+    outcomes = [bitboard.play (self.player, self.opponent, m) for m in moves]
+    priors = [1. / len(moves)] * len(moves)
+    if network is not None:
+      boards = bitboard.to_arrays (outcomes)
+      scores = network.score_positions (boards.reshape((len(moves), -1)))
+      top = max(scores)
+      weights = [math.exp ((s - top) / PRIOR_TEMPERATURE) for s in scores]
+      priors = [w / sum(weights) for w in weights]
+
+    for move, (p, o), prior in zip(moves, outcomes, priors):
+      self.children.append (Node (o, p, 1 - self.color, move, prior))
+
+
+  def select (self, c, use_priors):
+    "Child maximizing the UCT (or PUCT, with priors) score"
+    if not use_priors:
+      for child in self.children:
+        if child.visits == 0:
+          return child
+      log_n = math.log (self.visits)
+      return max (self.children, key = lambda ch:
+          ch.wins / ch.visits + c * math.sqrt (log_n / ch.visits))
+
+    sqrt_n = math.sqrt (self.visits)
+    return max (self.children, key = lambda ch:
+        (ch.wins / ch.visits if ch.visits > 0 else 0.5)
+          + c * ch.prior * sqrt_n / (1 + ch.visits))
+
+
+def search_tree (player, opponent, budget_ms, policy='tactics', c=1.4,
+                 seed=None, network=None):
+  """
+  Grows a tree from the position for budget_ms milliseconds. Returns the
+  dictionary move -> (visits, wins) of the children of the root and the
+  number of playouts. This is the task run by each worker of MCTSAgent.
+  """
+  rnd = random.Random (seed)
+  policy = POLICIES[policy]
+  root = Node (player, opponent, 0)
+  deadline = time.perf_counter() + budget_ms * 1e-3
+  n_playouts = 0
+  while n_playouts == 0 or time.perf_counter() < deadline:
+    ## Selection and expansion
+    node = root
+    path = [root]
+    while node.children is not None and len(node.children) > 0:
+      node = node.select (c, network is not None)
+      path.append (node)
+    if node.children is None and node.visits > 0 or node is root:
+      node.expand (network)
+      if len(node.children) > 0:
+        node = node.select (c, network is not None)
+        path.append (node)
+
+    ## Simulation, the result is for the player to move at the root
+    diff = playout (node.player, node.opponent, policy, rnd)
+    if node.color == 1: diff = -diff
+    result = 1. if diff > 0 else 0.5 if diff == 0 else 0.
+
+    ## Backpropagation
+    for n in path:
+      n.visits += 1
+      n.wins += result if n.color == 1 else 1. - result
+    n_playouts += 1
+
+  return {ch.move: (ch.visits, ch.wins) for ch in root.children}, n_playouts
+
+
+################################################################################
+## Agent
+class MCTSAgent:
+  """
+  Agent choosing the move visited the most by the trees grown by workers
+  processes within budget_ms milliseconds. The statistics of the last move
+  (including playouts per second) are stored in the attribute last, and
+  those of all the moves are returned by stats().
+  """
+  def __init__ (self, policy='tactics', budget_ms=200, workers=1, c=1.4,
+                network=None):
+    self.policy = policy
+    self.budget_ms = budget_ms
+    self.workers = workers
+    self.c = c
+    self.network = network
+    self.last = None
+    self.n_moves = 0
+    self.n_playouts = 0
+    self.seconds = 0.
+    self._pool = None
+
+
+  def _map (self, tasks):
+    "Runs the tasks in the pool of processes, created on first use"
+    ## Daemonic processes (e.g. the self-play farm workers) cannot have children
+    if self.workers <= 1 or multiprocessing.current_process().daemon:
+      return [search_tree (*t) for t in tasks[:1]]
+    if self._pool is None:
+      self._pool = multiprocessing.get_context('spawn').Pool (self.workers)
+    return self._pool.starmap (search_tree, tasks)
+
+
+  def __call__ (self, game, player, opponent):
+    p, o = bitboard.from_array(player), bitboard.from_array(opponent)
+    start = time.perf_counter()
+    seed = random.getrandbits (32)
+    tasks = [(p, o, self.budget_ms, self.policy, self.c, seed + k, self.network)
+             for k in range(self.workers)]
+
+    visits = dict()
+    n_playouts = 0
+    for children, n in self._map (tasks):
+      n_playouts += n
+      for move, (v, w) in children.items():
+        visits[move] = visits.get (move, 0) + v
+
+    move = max (visits, key = visits.get)
+    elapsed = time.perf_counter() - start
+    self.last = dict(playouts = n_playouts, ms = elapsed * 1e3,
+                     playouts_per_s = n_playouts / elapsed, visits = visits[move])
+    self.n_moves += 1
+    self.n_playouts += n_playouts
+    self.seconds += elapsed
+
+    return game.move_index (player, opponent, move)
+
+
+  def stats (self):
+    "Number of moves and of playouts, and playouts per second, over all the moves"
+    return summary ([self])
+
+
+  def close (self):
+    "Terminates the pool of processes"
+    if self._pool is not None:
+      self._pool.terminate()
+      self._pool = None
+
+
+def summary (agents):
+  "Statistics of several MCTSAgent (e.g. of concurrent games), summed"
+  n_playouts = sum (a.n_playouts for a in agents)
+  seconds = sum (a.seconds for a in agents)
+  return dict(moves = sum (a.n_moves for a in agents), playouts = n_playouts,
+              playouts_per_s = n_playouts / seconds if seconds > 0 else 0.)
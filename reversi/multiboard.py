@@ -0,0 +1,208 @@
+"""
+Multi-board rules
+-----------------
+
+Rules of reversi applied to a batch of K games at once. Each game is stored
+as a pair of bitboards (see bitboard.py) in numpy uint64 arrays, and the
+valid moves, the flipped tokens and the end of the games are computed for
+all the games with vectorized shift-and-mask operations.
+
+The positions reachable by all the games are listed in a single array,
+so that a network can score them in one batch per ply (see selfplay).
+As in rules.Game, white moves first.
+"""
+import numpy as np
+
+import bitboard
+
+_U64_ = np.uint64
+
+## Directions of bitboard.DIRECTIONS as numpy scalars
+DIRECTIONS = tuple((n, _U64_(mask)) for n, mask in bitboard.DIRECTIONS)
+
+
+def shift (bits, n, mask):
+  "Vectorized bitboard.shift on arrays of bitboards"
+  if n > 0:
+    return (bits << _U64_(n)) & mask
+  return (bits >> _U64_(-n)) & mask
+
+
+def valid_moves (player, opponent):
+  "Vectorized bitboard.valid_moves on arrays of bitboards"
+  empty = ~(player | opponent)
+  moves = np.zeros_like (player)
+  for n, mask in DIRECTIONS:
+    om = opponent & mask
+    x = shift (player, n, mask) & om
+    for _ in range(5):
+      x |= shift (x, n, mask) & om
+    moves |= shift (x, n, mask) & empty
+  return moves
+
+
+def flips (player, opponent, move):
+  "Vectorized bitboard.flips on arrays of bitboards and single-bit moves"
+  flipped = np.zeros_like (player)
+  zero = _U64_(0)
+  for n, mask in DIRECTIONS:
+    om = opponent & mask
+    x = shift (move, n, mask) & om
+    for _ in range(5):
+      x |= shift (x, n, mask) & om
+    ## The run of opponent's tokens must be closed by a player's token
+    closed = (shift (x, n, mask) & player) != zero
+    flipped |= np.where (closed, x, zero)
+  return flipped
+
+
+def count (bits):
+  "Number of tokens of each bitboard of an array"
+  raw = np.ascontiguousarray (bits, dtype='<u8').view(np.uint8)
+  return np.unpackbits (raw.reshape(bits.shape + (8,)), axis=-1).sum(axis=-1)
+
+
+def to_arrays (bits):
+  "Converts an array of K bitboards into an array of K 8x8 float32 boards"
+  raw = np.ascontiguousarray (bits, dtype='<u8').view(np.uint8)
+  unpacked = np.unpackbits (raw.reshape(bits.shape + (8,)), axis=-1, bitorder='little')
+  return unpacked.reshape(bits.shape + (8,8)).astype(np.float32)
+
+
+def split_moves (moves):
+  """
+  Lists the single-bit moves of an array of move masks. Returns the index
+  of the game and the single-bit mask of each move.
+  """
+  raw = np.ascontiguousarray (moves, dtype='<u8').view(np.uint8)
+  bits = np.unpackbits (raw.reshape(moves.shape + (8,)), axis=-1, bitorder='little')
+  iGame, iCell = np.nonzero (bits)
+  return iGame, _U64_(1) << iCell.astype(np.uint64)
+
+
+class BoardBatch:
+  """
+  K games advancing in lockstep. player and opponent are the bitboards of
+  the player to move and of the other one, white_to_move tells the color of
+  the player to move and done flags the finished games.
+  """
+  def __init__ (self, n_games):
+    ## Initial position, as in rules.Game: white on (3,3) and (4,4)
+    self.player = np.full (n_games, (1 << 27) | (1 << 36), dtype=np.uint64)
+    self.opponent = np.full (n_games, (1 << 28) | (1 << 35), dtype=np.uint64)
+    self.white_to_move = np.ones (n_games, dtype=bool)
+    self.done = np.zeros (n_games, dtype=bool)
+
+
+  def __len__ (self):
+    return len(self.player)
+
+
+  @property
+  def white (self):
+    return np.where (self.white_to_move, self.player, self.opponent)
+
+
+  @property
+  def black (self):
+    return np.where (self.white_to_move, self.opponent, self.player)
+
+
+  def valid_moves (self):
+    "Masks of the valid moves of the players to move"
+    return valid_moves (self.player, self.opponent)
+
+
+  def as_arrays (self):
+    "Boards as a (K, 2, 8, 8) array of (player to move, opponent)"
+    return np.stack ((to_arrays (self.player), to_arrays (self.opponent)), axis=1)
+
+
+  def successors (self):
+    """
+    Lists the valid moves of all the games. Returns the index of the game
+    and the single-bit mask of each move, and the (n_moves, 2, 8, 8) array
+    of the (player, opponent) boards after each move.
+    """
+    iGame, moves = split_moves (self.valid_moves())
+    p, o = self.player[iGame], self.opponent[iGame]
+    f = flips (p, o, moves)
+    boards = np.stack ((to_arrays (p | moves | f), to_arrays (o & ~f)), axis=1)
+    return iGame, moves, boards
+
+
+  def play (self, moves):
+    """
+    Applies one move per game (single-bit masks, 0 to pass) and hands the
+    turn to the opponent. The games where neither player can move are
+    flagged as done, and left untouched afterwards.
+    """
+    moves = np.where (self.done, _U64_(0), np.asarray (moves, dtype=np.uint64))
+    f = flips (self.player, self.opponent, moves)
+    player = self.player | moves | f
+    opponent = self.opponent & ~f
+
+    ## Hand the turn over, unless the game is already over
+    self.player = np.where (self.done, self.player, opponent)
+    self.opponent = np.where (self.done, self.opponent, player)
+    self.white_to_move = np.where (self.done, self.white_to_move, ~self.white_to_move)
+
+    blocked = (valid_moves (self.player, self.opponent) == 0) & (
+               valid_moves (self.opponent, self.player) == 0)
+    self.done |= blocked
+
+
+def best_per_game (iGame, scores, n_games):
+  """
+  Index of the highest score of each game, for scores listed with the game
+  index iGame as returned by BoardBatch.successors. -1 for games without moves
+  """
+  order = np.lexsort ((-np.asarray(scores), iGame))
+  first = np.full (n_games, -1)
+  sorted_games = iGame[order]
+  starts = np.r_[True, sorted_games[1:] != sorted_games[:-1]] if len(order) else []
+  first[sorted_games[starts]] = order[starts]
+  return first
+
+
+def selfplay (n_games, network=None, rng=None):
+  """
+  Plays n_games in lockstep. At each ply, the positions reachable by all
+  the games are scored in a single call to network.score_positions, and
+  each game plays its best move; without network the moves are random.
+  Returns the finished BoardBatch.
+  """
+  rng = rng if rng is not None else np.random.default_rng()
+  games = BoardBatch (n_games)
+  while not np.all (games.done):
+    iGame, moves, boards = games.successors()
+    if len(moves) == 0:
+      games.play (np.zeros (n_games, dtype=np.uint64)) ## everybody passes
+      continue
+
+    if network is not None:
+      scores = network.score_positions (boards.reshape((len(moves), -1)))
+    else:
+      scores = rng.random (len(moves))
+
+    best = best_per_game (iGame, scores, n_games)
+    chosen = np.where (best >= 0, moves[np.maximum(best, 0)], _U64_(0))
+    games.play (chosen)
+
+  return games
+
+
+
+if __name__ == '__main__':
+  import time
+  import argparse
+  parser = argparse.ArgumentParser()
+  parser.add_argument ("-k", "--games", default = 256, type = int)
+  cfg = parser.parse_args()
+
+  start = time.perf_counter()
+  games = selfplay (cfg.games)
+  elapsed = time.perf_counter() - start
+  nw, nb = count (games.white), count (games.black)
+  print ("%d games in %.2f s (%.1f games/s): %d white - %d black" % (
+    cfg.games, elapsed, cfg.games / elapsed, np.sum(nw > nb), np.sum(nb > nw)))
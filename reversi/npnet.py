@@ -0,0 +1,84 @@
+"""
+NumPy network
+-------------
+
+Inference-only replica of the network of NeuralNetwork_agent (reversi-ia.py)
+relying on numpy alone. The weights of the Dense layers are exported from
+the keras model to a compact .npz file, so that playing with the trained
+network does not require importing TensorFlow.
+"""
+import os
+import numpy as np
+
+import symmetry
+
+
+ACTIVATIONS = dict(
+  tanh = np.tanh,
+  linear = lambda x: x,
+)
+
+
+def export (model, path):
+  """
+  Writes the kernels, the biases and the activations of the Dense layers
+  of a keras model to the .npz file path
+  """
+  arrays = dict()
+  n_layers = 0
+  for layer in model.layers:
+    weights = layer.get_weights()
+    if len(weights) == 0: continue  ## Input, Flatten...
+    kernel, bias = weights
+    arrays['kernel_%d' % n_layers] = kernel.astype(np.float32)
+    arrays['bias_%d' % n_layers] = bias.astype(np.float32)
+    arrays['activation_%d' % n_layers] = np.array(layer.get_config()['activation'])
+    n_layers += 1
+
+  np.savez_compressed (path, n_layers=n_layers, **arrays)
+
+
+class NumpyNetwork_agent:
+  "Agent choosing the move with the highest score of the exported network"
+  def __init__ (self, path):
+    self.path = path
+    with np.load (path) as f:
+      self.layers = [
+          (f['kernel_%d' % i], f['bias_%d' % i], str(f['activation_%d' % i]))
+          for i in range(int(f['n_layers']))
+        ]
+    ## Scores averaged over the symmetric variants of the positions
+    self.symmetric = False
+
+
+  def score_positions (self, batch):
+    """
+    Scores a batch of positions, each defined by the flattened (player,
+    opponent) boards. If symmetric, the scores are averaged over the 8
+    symmetric variants. Returns an array of shape (n_positions,)
+    """
+    x = np.asarray (batch, dtype=np.float32).reshape((-1, 8*8*2))
+    if self.symmetric:
+      return symmetry.averaged_scores (self._score, x)
+    return self._score (x)
+
+
+  def _score (self, x):
+    for kernel, bias, activation in self.layers:
+      x = ACTIVATIONS[activation] (x @ kernel + bias)
+    return x.reshape(-1)
+
+
+  def __call__ (self, game, player, opponent):
+    moves, outcomes = game.successors(player, opponent)
+    scores = self.score_positions (outcomes.reshape((len(moves), -1)))
+    return int(np.argmax (scores))
+
+
+  @staticmethod
+  def load (name):
+    "Loads the network exported as name.npz next to this module"
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name + ".npz")
+    if not os.path.exists (path):
+      raise IOError ("%s not found, export it with reversi-ia.py --export-npz" % path)
+    return NumpyNetwork_agent (path)
@@ -0,0 +1,161 @@
+"""
+Replay buffer
+-------------
+
+Fixed-capacity store of training positions for the neural-network agent,
+sampled uniformly across many games. Positions (the 128 entries of the
+flattened player and opponent boards) are packed into 16 bytes, and
+stored with their label in preallocated numpy arrays: when the buffer is
+full, the oldest positions are overwritten (ring buffer), so the memory
+used is bounded by the capacity and not by the number of games played.
+
+Optionally, the arrays are memory-mapped shards of a directory, so that
+training data survive restarts. Several processes may open the same
+directory and append concurrently: the write cursor is stored in a shared
+memory-mapped header and appends are serialized with a file lock.
+"""
+import os
+import contextlib
+import threading
+import numpy as np
+
+try:
+  import fcntl
+except ImportError:  ## not available on Windows, appends are serialized per process
+  fcntl = None
+
+POSITION_SIZE = 8*8*2
+PACKED_SIZE = POSITION_SIZE // 8
+
+## Fields of the shared header
+_CURSOR_, _SIZE_, _CAPACITY_, _SHARD_SIZE_ = range(4)
+
+
+class ReplayBuffer:
+  """
+  Ring buffer of (position, label) pairs with the given capacity, held in
+  memory or, if path is given, in memory-mapped shards of shard_size
+  positions stored in the directory path.
+  """
+  def __init__ (self, capacity, path=None, shard_size=1 << 16):
+    self.path = path
+    self._lock = threading.Lock()
+    self._lockfile = None
+
+    if path is None:
+      self._header = np.array ([0, 0, capacity, capacity], dtype=np.int64)
+    else:
+      os.makedirs (path, exist_ok=True)
+      self._lockfile = open (os.path.join (path, "lock"), "a+")
+      with self._locked():
+        self._header = self._open_header (capacity, shard_size)
+
+    self.capacity = int(self._header[_CAPACITY_])
+    self.shard_size = int(self._header[_SHARD_SIZE_])
+
+    ## Shards are created under the lock, not to be opened half-written
+    n_shards = (self.capacity + self.shard_size - 1) // self.shard_size
+    self._positions, self._labels = [], []
+    with self._locked():
+      for iShard in range(n_shards):
+        n = min(self.shard_size, self.capacity - iShard * self.shard_size)
+        self._positions.append (self._array ("positions-%05d.npy" % iShard, (n, PACKED_SIZE), np.uint8))
+        self._labels.append (self._array ("labels-%05d.npy" % iShard, (n,), np.float32))
+
+
+  def _open_header (self, capacity, shard_size):
+    "Opens (or creates) the header shared by the processes using path"
+    filename = os.path.join (self.path, "header.npy")
+    if os.path.exists (filename):
+      header = np.lib.format.open_memmap (filename, mode='r+')
+      if header[_CAPACITY_] != capacity:
+        raise ValueError ("Replay buffer %s has capacity %d, not %d" % (
+          self.path, header[_CAPACITY_], capacity))
+      return header
+
+    header = np.lib.format.open_memmap (filename, mode='w+', dtype=np.int64, shape=(4,))
+    header[:] = [0, 0, capacity, min(capacity, shard_size)]
+    header.flush()
+    return header
+
+
+  def _array (self, name, shape, dtype):
+    "Preallocated array, memory-mapped on the shard name if path is defined"
+    if self.path is None:
+      return np.zeros (shape, dtype=dtype)
+    filename = os.path.join (self.path, name)
+    if os.path.exists (filename):
+      return np.lib.format.open_memmap (filename, mode='r+')
+    return np.lib.format.open_memmap (filename, mode='w+', dtype=dtype, shape=shape)
+
+
+  @contextlib.contextmanager
+  def _locked (self):
+    "Serializes the access to the buffer among threads and processes"
+    with self._lock:
+      shared = self._lockfile is not None and fcntl is not None
+      if shared:
+        fcntl.flock (self._lockfile, fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        if shared:
+          fcntl.flock (self._lockfile, fcntl.LOCK_UN)
+
+
+  def __len__ (self):
+    return int(self._header[_SIZE_])
+
+
+  def append (self, positions, labels):
+    """
+    Appends the positions, an array of shape (n, 128), with their labels,
+    a scalar or an array of shape (n,), overwriting the oldest ones when
+    the buffer is full
+    """
+    positions = np.asarray (positions).reshape((-1, POSITION_SIZE))
+    labels = np.broadcast_to (np.asarray (labels, dtype=np.float32), (len(positions),))
+    if len(positions) > self.capacity:
+      positions, labels = positions[-self.capacity:], labels[-self.capacity:]
+    packed = np.packbits (positions > 0, axis=1)
+
+    with self._locked():
+      cursor = int(self._header[_CURSOR_])
+      index = (cursor + np.arange (len(packed))) % self.capacity
+      for iShard in np.unique (index // self.shard_size):
+        sel = index // self.shard_size == iShard
+        offset = index[sel] % self.shard_size
+        self._positions[iShard][offset] = packed[sel]
+        self._labels[iShard][offset] = labels[sel]
+
+      self._header[_CURSOR_] = (cursor + len(packed)) % self.capacity
+      self._header[_SIZE_] = min(self.capacity, int(self._header[_SIZE_]) + len(packed))
+
+
+  def sample (self, n, rng=None):
+    """
+    Draws n positions uniformly from the buffer. Returns the float32 array
+    of the positions, with shape (n, 128), and the array of their labels
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    size = len(self)
+    if size == 0:
+      raise ValueError ("Cannot sample from an empty replay buffer")
+
+    index = rng.integers (0, size, n)
+    iShard, offset = index // self.shard_size, index % self.shard_size
+    packed = np.empty ((n, PACKED_SIZE), dtype=np.uint8)
+    labels = np.empty (n, dtype=np.float32)
+    for k in np.unique (iShard):
+      sel = iShard == k
+      packed[sel] = self._positions[k][offset[sel]]
+      labels[sel] = self._labels[k][offset[sel]]
+
+    return np.unpackbits (packed, axis=1).astype(np.float32), labels
+
+
+  def flush (self):
+    "Writes the memory-mapped shards to disk"
+    if self.path is None: return
+    for array in [self._header] + self._positions + self._labels:
+      array.flush()
@@ -3,22 +3,45 @@ This module define three simple artificial intelligence strategies for reversi:
  - random moves
  - weighted random moves (borders are more appealing)
  - deep neural network 
+ - deep neural network evaluated with numpy only (weights exported from 
+   the previous one, see npnet.py)
+ - alpha-beta search with iterative deepening (see search.py)
+ - parallel Monte-Carlo tree search (see mcts.py)
+Any of them can hand over to an exact endgame solver (see endgame.py), 
+and play the openings from a book recorded from previous games (see book.py).
 
 
 The strategies are called "agents". An additional agent is defined for 
 "human" decision on the moves. 
 An agent is a callable that takes a Game instance as input, together with 
-the board of the player's and opponent's tokens. 
+the board of the player's and opponent's tokens. It returns the boards with
+the player's new token, or, for trusted agents, the index of its move in the
+list of the valid moves of the turn (Game.turn_moves), which saves the 
+validation of the move. 
 In the case of the neural network agent, the callable is class which holds 
 the necessary configurations of the neural network.
 
-A class GameAi inherits from reversi.Game and implements the definition
+A class GameAi inherits from rules.Game and implements the definition
 of two agents for both the white and the black players.
 
-The argparse module is used to setup the match from command line
+The argparse module is used to setup the match from command line.
+With --match, a fixed number of games is played alternating the colors, 
+and the statistics are written as JSON (see match.py).
+TensorFlow is imported only when one of the agents needs it.
 """
-import tensorflow as tf
-import reversi 
+import rules 
+import bitboard 
+import npnet 
+import transposition 
+import search 
+import endgame 
+import mcts 
+import match 
+import replay 
+import symmetry 
+import book 
+import instrument 
+import inference 
 import numpy as np 
 
 import argparse 
@@ -27,11 +50,7 @@ import argparse
 ## Random agent
 def random_agent (game, player, opponent):
   moves = game.list_valid_move(player, opponent) 
-  index = np.random.choice (len(moves)) 
-  i, j = moves [index] 
-  player_ = player.copy()
-  player_[i,j] = 1
-  return player_, opponent 
+  return np.random.choice (len(moves)) 
 
 ################################################################################
 ## Border-enhanced agent (tactics)
@@ -44,164 +63,508 @@ def tactics_agent (game, player, opponent):
     if j == 0 or j  == 7:
       w[n] *= 2
       
-  index = np.random.choice (len(moves), p=w/np.sum(w)) 
-  i, j = moves [index] 
-  player_ = player.copy()
-  player_[i,j] = 1
-  return player_, opponent 
+  return np.random.choice (len(moves), p=w/np.sum(w)) 
 
 
 ################################################################################
 ## Neural-network based agent
 class NeuralNetwork_agent:
-  def __init__ (self, name):
+  def __init__ (self, name, net=None, buffer=None):
     self.name = name 
-    self.net = tf.keras.models.Sequential()
-    self.net.add (tf.keras.layers.Input(8*8*2, dtype=np.float32))
-    self.net.add (tf.keras.layers.Flatten())
-    self.net.add (tf.keras.layers.Dense(256, activation = 'tanh'))
-    self.net.add (tf.keras.layers.Dense(256, activation = 'tanh'))
-    #self.net.add (tf.keras.layers.Dense(16, activation = 'tanh'))
-    self.net.add (tf.keras.layers.Dense(1)) 
-    self.net.compile (tf.keras.optimizers.Adam(1e-3), tf.keras.losses.MeanSquaredError())
+    self.net = net 
+    ## Optional replay.ReplayBuffer: training samples positions of many games
+    self.buffer = buffer 
+    ## A new network is built only if no (previously saved) net is given
+    if self.net is None:
+      import tensorflow as tf
+      self.net = tf.keras.models.Sequential()
+      self.net.add (tf.keras.layers.Input(8*8*2, dtype=np.float32))
+      self.net.add (tf.keras.layers.Flatten())
+      self.net.add (tf.keras.layers.Dense(256, activation = 'tanh'))
+      self.net.add (tf.keras.layers.Dense(256, activation = 'tanh'))
+      #self.net.add (tf.keras.layers.Dense(16, activation = 'tanh'))
+      self.net.add (tf.keras.layers.Dense(1)) 
+      self.net.compile (tf.keras.optimizers.Adam(1e-3), tf.keras.losses.MeanSquaredError())
     self.batch = [] 
     self.oppbatch = [] 
+    ## Positions are collected for training only by networks being trained
+    self.training = True 
+    ## Scores averaged over the symmetric variants of the positions
+    self.symmetric = False 
+
+
+  def score_positions (self, batch):
+    """
+    Scores a batch of positions, each defined by the flattened (player, 
+    opponent) boards, in a single forward pass of the network. 
+    If symmetric, the scores are averaged over the 8 symmetric variants.
+    Returns an array of shape (n_positions,)
+    """
+    batch = np.asarray (batch, dtype=np.float32).reshape((-1, 8*8*2)) 
+    if self.symmetric:
+      return symmetry.averaged_scores (self._score, batch) 
+    return self._score (batch) 
+
+
+  def _score (self, batch):
+    return np.asarray (self.net(batch, training=False)).reshape(-1) 
 
 
   def __call__ (self, game, player, opponent):
-    moves = game.list_valid_move(player, opponent) 
-    best_score = -1000000
-    best_move = 0
-    best_player, best_opponent = None, None
-    for iMove, (i, j) in enumerate(moves): 
-      p0, o0 = player.copy(), opponent.copy()
-      p, o = player.copy(), opponent.copy()
-      p[i,j] = 1
-      p1, o1 = p.copy(), o.copy()
-      p1, o1 = game.move_outcome (p1, o1, p0, o0) 
-      move = np.stack((p1,o1)).reshape((1,-1))
-      new_score = self.net(move)
-      if new_score > best_score: 
-        best_score = new_score 
-        best_move  = p, o
-        best_player   = p1
-        best_opponent = o1
-
-    self.batch.append (np.stack((best_player, best_opponent)).reshape(-1))
-    self.batch.append (np.stack((best_player[::-1], best_opponent[::-1])).reshape(-1))
-    self.batch.append (np.stack((best_player[:,::-1], best_opponent[:,::-1])).reshape(-1))
-    self.batch.append (np.stack((best_player[::-1,::-1], best_opponent[::-1,::-1])).reshape(-1))
-    self.batch.append (np.stack((best_player.T, best_opponent.T)).reshape(-1))
-    self.batch.append (np.stack((best_player.T[::-1], best_opponent.T[::-1])).reshape(-1))
-    self.batch.append (np.stack((best_player.T[:,::-1], best_opponent.T[:,::-1])).reshape(-1))
-    self.batch.append (np.stack((best_player.T[::-1,::-1], best_opponent.T[::-1,::-1])).reshape(-1))
-
-    best_opponent, best_player = best_player, best_opponent 
-    self.oppbatch.append (np.stack((best_player, best_opponent)).reshape(-1))
-    self.oppbatch.append (np.stack((best_player[::-1], best_opponent[::-1])).reshape(-1))
-    self.oppbatch.append (np.stack((best_player[:,::-1], best_opponent[:,::-1])).reshape(-1))
-    self.oppbatch.append (np.stack((best_player[::-1,::-1], best_opponent[::-1,::-1])).reshape(-1))
-    self.oppbatch.append (np.stack((best_player.T, best_opponent.T)).reshape(-1))
-    self.oppbatch.append (np.stack((best_player.T[::-1], best_opponent.T[::-1])).reshape(-1))
-    self.oppbatch.append (np.stack((best_player.T[:,::-1], best_opponent.T[:,::-1])).reshape(-1))
-    self.oppbatch.append (np.stack((best_player.T[::-1,::-1], best_opponent.T[::-1,::-1])).reshape(-1))
-
-    return best_move
+    moves, outcomes = game.successors(player, opponent) 
+    scores = self.score_positions (outcomes.reshape((len(moves), -1))) 
+    iBest = int(np.argmax (scores)) 
+
+    if self.training:
+      best_player, best_opponent = outcomes [iBest]
+      self.add_position (best_player, best_opponent) 
+
+    return iBest
     
 
+  def add_position (self, player, opponent):
+    """
+    Appends the position reached by the player, with its 8 symmetric 
+    variants, to the training batch, and the same position seen from the 
+    opponent's side to the opponent's batch. 
+    """
+    variants = symmetry.transforms (np.stack((player, opponent))) 
+    self.batch.extend (variants.reshape((8, -1))) 
+    self.oppbatch.extend (variants[:, ::-1].reshape((8, -1))) 
+
+
   def train_step (self, label, nEpochs=1):
-    for iEpoch in range(nEpochs):
-      self.net.train_on_batch (np.array(self.batch), np.full(len(self.batch), label))
-      self.net.train_on_batch (np.array(self.oppbatch), np.full(len(self.batch), -label))
+    """
+    Trains the network on the accumulated batches. The label is the final
+    disc differential, either one value for the whole batch or one value 
+    per entry of the batch. 
+    With a replay buffer, the batches are appended to the buffer and the 
+    network is trained on as many positions drawn uniformly from it. 
+    """
+    ## Nothing to train on, e.g. the network did not play a move
+    if len(self.batch) == 0: return 
+
+    labels = np.broadcast_to (np.asarray(label, dtype=np.float32), (len(self.batch),))
+    if self.buffer is not None:
+      self.buffer.append (np.array(self.batch), labels) 
+      self.buffer.append (np.array(self.oppbatch), -labels) 
+      for iEpoch in range(nEpochs):
+        self.net.train_on_batch (*self.buffer.sample (2*len(self.batch))) 
+    else:
+      for iEpoch in range(nEpochs):
+        self.net.train_on_batch (np.array(self.batch), labels)
+        self.net.train_on_batch (np.array(self.oppbatch), -labels)
     self.batch = [] 
     self.oppbatch = [] 
 
   def save(self):
     self.net.save(self.name) 
+    if self.buffer is not None:
+      self.buffer.flush() 
+
+  def export(self):
+    "Exports the weights to name.npz for the numpy-only agent (npnet.py)"
+    import os
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),self.name)
+    npnet.export (self.net, path + ".npz") 
 
   @staticmethod 
   def load(name):
     import os
+    import tensorflow as tf
     path = os.path.join(os.path.dirname(os.path.abspath(__file__)),name)
-    net = NeuralNetwork_agent(name)
-    net.net = tf.keras.models.load_model(path) 
+    net = NeuralNetwork_agent(name, tf.keras.models.load_model(path))
+    net.training = False 
     return net 
     
     
       
 
 ################################################################################
-## Class inheriting from reversi.Game, but opening to the definition of 
+## Class inheriting from rules.Game, but opening to the definition of 
 ## two agents for the white and black players. 
 ## If white_agent == 'human' and black_agent == 'human', then GameAi is 
 ## identical to Game. Otherwise, the respective agents are invoked to 
 ## define the moves of the two players. 
-class GameAi (reversi.Game):
+class GameAi (rules.Game):
   def __init__ (self, white_agent, black_agent):
     self.white_agent = white_agent
     self.black_agent = black_agent 
-    reversi.Game.__init__(self) 
+    rules.Game.__init__(self) 
 
   def white_moves (self, w0, b0):
-    if self.white_agent == 'human': return reversi.Game.white_moves(self, w0, b0) 
-    w, b = self.white_agent (self, w0, b0) 
-    return w,b
+    if self.white_agent == 'human': return rules.Game.white_moves(self, w0, b0) 
+    return self.white_agent (self, w0, b0) 
 
   def black_moves (self, w0, b0):
-    if self.black_agent == 'human': return reversi.Game.black_moves(self, w0, b0) 
-    b, w = self.black_agent (self, b0, w0) 
+    if self.black_agent == 'human': return rules.Game.black_moves(self, w0, b0) 
+    ret = self.black_agent (self, b0, w0) 
+    if isinstance (ret, (int, np.integer)): 
+      return ret ## index of a trusted agent
+    b, w = ret 
     return w,b 
 
 
 
-if __name__ == '__main__':
-  nn = NeuralNetwork_agent("reversiNN") 
-  agents = dict(
-    random=random_agent, 
-    tactics=tactics_agent, 
-    human="human", 
-    train=nn, 
-    nnet=NeuralNetwork_agent.load('reversiNN'), 
-  )
+################################################################################
+## Registry of the agents. 
+## Each entry is a factory, called only when the agent is actually selected,
+## so that networks (and TensorFlow) are loaded only when needed. 
+## Agents built with make_agent are cached by name in the given dictionary, 
+## hence both sides selecting the same agent share the same instance. 
+def alphabeta_agent (cfg, cache):
+  """
+  Negamax search agent (see search.py), with the evaluator cfg.search_eval 
+  and a transposition table of cfg.tt_size entries, kept across the moves 
+  and the games
+  """
+  if cfg.search_eval == 'tactics':
+    evaluator = search.TacticsEvaluator() 
+  else:
+    evaluator = search.NetworkEvaluator (make_agent (cfg.search_eval, cache, cfg)) 
+  table = transposition.TranspositionTable (cfg.tt_size, symmetric=False) 
+  return search.NegamaxAgent (evaluator, budget_ms = cfg.search_ms, table = table) 
+
+
+def mcts_agent (cfg, cache):
+  "Monte-Carlo tree search agent (see mcts.py), with network priors if required"
+  network = make_agent ('npnet', cache, cfg) if cfg.mcts_priors else None 
+  return mcts.MCTSAgent (cfg.mcts_policy, budget_ms = cfg.mcts_ms, 
+      workers = cfg.mcts_workers, network = network) 
+
+
+def network_agent (agent, cfg):
+  """
+  Network agent, averaging its scores over the symmetries if required, and 
+  served in batches by an inference server with concurrent games
+  """
+  agent.symmetric = cfg.symmetric_eval 
+  if cfg.threads > 1:
+    return inference.BatchedAgent (inference.InferenceServer (agent, 
+        cfg.inference_batch, cfg.inference_ms)) 
+  return agent 
+
+
+AGENTS = dict(
+  random = lambda cfg, cache: random_agent, 
+  tactics = lambda cfg, cache: tactics_agent, 
+  human = lambda cfg, cache: "human", 
+  train = lambda cfg, cache: NeuralNetwork_agent("reversiNN"), 
+  nnet = lambda cfg, cache: network_agent (NeuralNetwork_agent.load('reversiNN'), cfg), 
+  npnet = lambda cfg, cache: network_agent (npnet.NumpyNetwork_agent.load('reversiNN'), cfg), 
+  alphabeta = alphabeta_agent, 
+  mcts = mcts_agent, 
+)
+
+def make_agent (name, cache, cfg):
+  """
+  Returns the agent name from cache, building it on first use with the 
+  options cfg parsed from command line
+  """
+  if name not in cache:
+    cache[name] = AGENTS[name](cfg, cache) 
+  return cache[name] 
+
+
+## Agents of the cache which concurrent games can share: the stateless ones,
+## the networks (served by an inference server with --threads) and the book
+THREAD_SAFE = ('random', 'tactics', 'nnet', 'npnet', 'book') 
+
+def make_book (cache, cfg):
+  "Returns the opening book cfg.book from cache, loading it on first use"
+  if 'book' not in cache:
+    cache['book'] = book.OpeningBook.open (cfg.book, cfg.book_depth, cfg.book_min_samples) 
+  return cache['book'] 
+
+
+def side_agent (name, cache, cfg):
+  """
+  Returns the agent playing one side: the agent name, handing over to the 
+  endgame solver for the last cfg.endgame empty cells, if enabled, and 
+  playing from the opening book cfg.book, unless the book is being recorded
+  """
+  agent = make_agent (name, cache, cfg) 
+  if cfg.endgame > 0 and name != 'human':
+    agent = endgame.EndgameAgent (agent, cfg.endgame) 
+  if cfg.book is not None and not cfg.book_record and name != 'human':
+    agent = book.BookAgent (make_book (cache, cfg), agent) 
+  return agent 
+
+
+
+################################################################################
+## Self-play farm. 
+## Games are spread over a pool of worker processes, streaming the finished
+## game records back to the parent process, which trains the network.
+## Boards are shipped as bitboards (see bitboard.py) to keep records compact.
+_FARM_QUEUE_ = None 
+_FARM_AGENTS_ = dict() 
 
+def _farm_init (queue):
+  "Initializer of the worker processes, storing the queue of the records"
+  global _FARM_QUEUE_
+  _FARM_QUEUE_ = queue 
+
+
+def _farm_agent (name, weights, cfg):
+  "Builds (once per worker) the agent, updating the weights of the trainee"
+  if name == 'human':
+    raise ValueError ("Agent %s cannot play in the self-play farm" % name)
+
+  agent = side_agent (name, _FARM_AGENTS_, cfg) 
+  if name == 'train' and weights is not None:
+    _FARM_AGENTS_[name].net.set_weights (weights) 
+  return agent
+
+
+def _farm_play (white, black, nGames, weights, cfg):
+  """
+  Worker task: plays nGames and puts a record per game in the queue, 
+  with the per-move boards and the final score
+  """
+  white_agent = _farm_agent (white, weights, cfg) 
+  black_agent = _farm_agent (black, weights, cfg) 
+  for iGame in range(nGames):
+    g = GameAi (white_agent, black_agent) 
+    g.run() 
+    for agent in _FARM_AGENTS_.values():
+      if isinstance (agent, NeuralNetwork_agent):
+        agent.batch, agent.oppbatch = [], [] 
+
+    _FARM_QUEUE_.put (dict(
+      moves = [(side, bitboard.from_array(w), bitboard.from_array(b)) 
+                for side, w, b in g.history],
+      white = int(np.count_nonzero(g.white)),
+      black = int(np.count_nonzero(g.black)),
+    ))
+  return nGames 
+
+
+def selfplay_farm (nn, cfg, opening_book=None):
+  """
+  Plays games forever on cfg.workers processes, each playing 
+  cfg.games_per_worker games per round with the weights of nn at the 
+  beginning of the round. Positions reached by the 'train' agents are 
+  collected from the records and nn is trained every cfg.train_games games. 
+  The games are recorded in opening_book, if defined. 
+  """
+  white, black = cfg.white, cfg.black 
+  nWorkers, nGamesPerWorker, nTrainGames = cfg.workers, cfg.games_per_worker, cfg.train_games
+  import multiprocessing 
+  from queue import Empty 
+  ctx = multiprocessing.get_context ('spawn') 
+  queue = ctx.Queue() 
+  tot_w, tot_b, nGames, nPending = 0, 0, 0, 0
+  labels = [] 
+  with ctx.Pool (nWorkers, initializer=_farm_init, initargs=(queue,)) as pool:
+    while True:
+      weights = nn.net.get_weights() if 'train' in (white, black) else None
+      tasks = pool.starmap_async (_farm_play, 
+          [(white, black, nGamesPerWorker, weights, cfg)] * nWorkers)
+
+      for iRecord in range(nWorkers * nGamesPerWorker): 
+        record = None 
+        while record is None:
+          try:
+            record = queue.get (timeout=1.) 
+          except Empty:
+            ## A worker failing would never send its records: raise its error
+            if tasks.ready(): tasks.get() 
+        nw, nb = record['white'], record['black'] 
+        tot_w += nw > nb 
+        tot_b += nb > nw 
+        nGames += 1
+        if opening_book is not None:
+          opening_book.record (record['moves'], nw, nb) 
+
+        for side, w, b in record['moves']:
+          if (white if side == 'white' else black) != 'train': continue 
+          w, b = bitboard.to_array (w), bitboard.to_array (b) 
+          if side == 'white': 
+            nn.add_position (w, b) 
+            labels += [nw - nb] * 8 
+          else:
+            nn.add_position (b, w) 
+            labels += [nb - nw] * 8 
+        nPending += 1 
+
+        if nPending >= nTrainGames and len(labels) > 0:
+          nn.train_step (np.array(labels)) 
+          labels, nPending = [], 0 
+          ## Don't save quick tests 
+          if nGames > 100:
+            nn.save()
+
+      tasks.get() 
+      print ("%5d games: %d white - %d black" % ( nGames, tot_w, tot_b )) 
+      if opening_book is not None:
+        opening_book.save (cfg.book) 
+
+
+
+if __name__ == '__main__':
   parser = argparse.ArgumentParser()
-  parser.add_argument ("-w", "--white", default = "human", choices = agents.keys())
-  parser.add_argument ("-b", "--black", default = "random", choices = agents.keys())
+  parser.add_argument ("-w", "--white", default = "human", choices = AGENTS.keys())
+  parser.add_argument ("-b", "--black", default = "random", choices = AGENTS.keys())
   parser.add_argument ("-q", "--quiet", action='store_true')
+  parser.add_argument ("-n", "--match", default = 0, type = int, 
+      help = "Play a match of this many games alternating colors, then exit")
+  parser.add_argument ("--stats", default = None, 
+      help = "JSON file for the statistics of the match (default: stdout)")
+  parser.add_argument ("-j", "--workers", default = 1, type = int, 
+      help = "Number of self-play processes in quiet mode")
+  parser.add_argument ("--games-per-worker", default = 8, type = int, 
+      help = "Games played by each process between two weight updates")
+  parser.add_argument ("--train-games", default = 32, type = int, 
+      help = "Games collected before each training step")
+  parser.add_argument ("--search-ms", default = 100, type = float, 
+      help = "Time budget per move of the alphabeta agent, in milliseconds")
+  parser.add_argument ("--search-eval", default = "tactics", 
+      choices = ['tactics', 'npnet', 'nnet'], 
+      help = "Leaf evaluator of the alphabeta agent")
+  parser.add_argument ("--mcts-ms", default = 200, type = float, 
+      help = "Time budget per move of the mcts agent, in milliseconds")
+  parser.add_argument ("--mcts-workers", default = 1, type = int, 
+      help = "Processes growing independent trees for the mcts agent")
+  parser.add_argument ("--mcts-policy", default = "tactics", 
+      choices = ['random', 'tactics'], help = "Playout policy of the mcts agent")
+  parser.add_argument ("--mcts-priors", action = 'store_true', 
+      help = "Use the npnet scores as priors of the mcts agent")
+  parser.add_argument ("--endgame", default = 0, type = int, 
+      help = "Empty cells below which the endgame solver plays (0: never)")
+  parser.add_argument ("--tt-size", default = 200000, type = int, 
+      help = "Entries of the transposition table of the alphabeta agent")
+  parser.add_argument ("--symmetric-eval", action='store_true', 
+      help = "Average the network scores over the 8 symmetries of the board")
+  parser.add_argument ("--replay-size", default = 0, type = int, 
+      help = "Positions kept in the replay buffer of the trained network (0: none)")
+  parser.add_argument ("--replay-dir", default = None, 
+      help = "Directory of the memory-mapped replay buffer, kept across runs")
+  parser.add_argument ("--book", default = None, 
+      help = "Opening book (.npz) consulted by the agents before searching")
+  parser.add_argument ("--book-depth", default = 12, type = int, 
+      help = "Plies played from the opening book")
+  parser.add_argument ("--book-min-samples", default = 8, type = int, 
+      help = "Games needed for a move of the opening book to be played")
+  parser.add_argument ("--book-record", action='store_true', 
+      help = "Record the games in the opening book instead of playing from it")
+  parser.add_argument ("--threads", default = 1, type = int, 
+      help = "Games of the match played concurrently, with batched network inference")
+  parser.add_argument ("--inference-batch", default = 256, type = int, 
+      help = "Positions per batch of the inference server (with --threads)")
+  parser.add_argument ("--inference-ms", default = 2, type = float, 
+      help = "Delay before flushing an incomplete inference batch, in milliseconds")
+  parser.add_argument ("--profile-json", default = None, 
+      help = "JSON file for the timings of the game functions (not in the farm)")
+  parser.add_argument ("--profile-collapsed", default = None, 
+      help = "Collapsed-stack file of the timings, for flame graphs (not in the farm)")
+  parser.add_argument ("--export-npz", action='store_true', 
+      help = "Export the trained network to reversiNN.npz for npnet and exit")
   cfg = parser.parse_args() 
 
-  if cfg.quiet and (cfg.white == 'human' or cfg.black == 'human'):
+  if cfg.export_npz:
+    NeuralNetwork_agent.load('reversiNN').export() 
+    exit() 
+
+  if cfg.threads > 1 and 'train' in (cfg.white, cfg.black):
+    raise ValueError ("The trained network cannot play concurrent games (--threads)") 
+
+  if cfg.book_record and cfg.book is None:
+    raise ValueError ("--book-record requires the path of the book (--book)") 
+
+  ## Only the selected agents are built, the network is shared if needed
+  agents = dict() 
+  white_agent = side_agent (cfg.white, agents, cfg) 
+  black_agent = side_agent (cfg.black, agents, cfg) 
+  nn = agents.get ('train') 
+  opening_book = make_book (agents, cfg) if cfg.book_record else None 
+  if nn is not None and cfg.replay_size > 0:
+    nn.buffer = replay.ReplayBuffer (cfg.replay_size, cfg.replay_dir) 
+
+  if (cfg.quiet or cfg.match > 0) and (cfg.white == 'human' or cfg.black == 'human'):
     raise ValueError ("Cannot play in batch mode with human agent") 
  
   from functools import partial 
-  MyGame = partial(GameAi, white_agent=agents[cfg.white], black_agent=agents[cfg.black]) 
-
-
-  if cfg.quiet:
-    tot_b = 0
-    tot_w = 0
-    while True: 
-      g = MyGame()
-      g.run() 
-      nb = np.count_nonzero(g.black)
-      nw = np.count_nonzero(g.white)
-      if nb>nw:
-        tot_b += 1
-      elif nw>nb: 
-        tot_w += 1
-
-      if cfg.white == 'train': 
-        nn.train_step ( nw - nb ) 
-      if cfg.black == 'train': 
-        nn.train_step ( nb - nw ) 
+  profiler = None 
+  if cfg.profile_json is not None or cfg.profile_collapsed is not None:
+    profiler = instrument.Profiler (cfg.profile_json, cfg.profile_collapsed) 
+
+  def new_game (w, b):
+    "Game between the agents w and b, instrumented if required"
+    g = GameAi (w, b) 
+    return profiler.install (g) if profiler is not None else g 
+
+  MyGame = partial(new_game, white_agent, black_agent) 
+
+  ## Caches of the agents of all the games, those of the concurrent games 
+  ## being built by make_agents
+  caches = [agents] 
+
+  def make_agents ():
+    "Agents of a concurrent game, with their own search state (see THREAD_SAFE)"
+    cache = {name: agents[name] for name in THREAD_SAFE if name in agents} 
+    caches.append (cache) 
+    return side_agent (cfg.white, cache, cfg), side_agent (cfg.black, cache, cfg) 
+
+  def mcts_agents ():
+    return [cache['mcts'] for cache in caches if 'mcts' in cache] 
+
+
+  try:
+    if cfg.match > 0:
+      stats = match.run_match (new_game, 
+          white_agent, black_agent, cfg.match, names = (cfg.white, cfg.black), 
+          on_game = opening_book.record_game if opening_book is not None else None, 
+          threads = cfg.threads, make_agents = make_agents) 
+      if len(mcts_agents()) > 0:
+        stats['mcts'] = mcts.summary (mcts_agents()) 
+      match.write_stats (stats, cfg.stats) 
+      if opening_book is not None:
+        opening_book.save (cfg.book) 
+    elif cfg.quiet and cfg.workers > 1:
+      selfplay_farm (nn, cfg, opening_book) 
+    elif cfg.quiet:
+      tot_b = 0
+      tot_w = 0
+      nGames = 0
+      while True: 
+        g = MyGame()
+        g.run() 
+        nGames += 1
+        nb = np.count_nonzero(g.black)
+        nw = np.count_nonzero(g.white)
+        if nb>nw:
+          tot_b += 1
+        elif nw>nb: 
+          tot_w += 1
+        if opening_book is not None:
+          opening_book.record_game (g) 
+
+        if cfg.white == 'train': 
+          nn.train_step ( nw - nb ) 
+        if cfg.black == 'train': 
+          nn.train_step ( nb - nw ) 
       
-      ## Don't save quick tests 
-      if tot_b + tot_w > 100:
-        nn.save()
+        ## Don't save quick tests 
+        if nn is not None and tot_b + tot_w > 100:
+          nn.save()
 
     
-      print ("%15s: %d white - %d black" % ( g.status, tot_w, tot_b )) 
-  else: 
-    reversi.play(MyGame) 
+        print ("%15s: %d white - %d black" % ( g.status, tot_w, tot_b )) 
+        if opening_book is not None and nGames % 100 == 0:
+          opening_book.save (cfg.book) 
+        if 'alphabeta' in agents and nGames % 100 == 0:
+          print ("Transposition table: %(entries)d entries, hit rate %(hit_rate).3f, "
+                 "%(evictions)d evictions" % agents['alphabeta'].table.stats()) 
+        if 'mcts' in agents and nGames % 100 == 0:
+          print ("MCTS: %(moves)d moves, %(playouts)d playouts, "
+                 "%(playouts_per_s).0f playouts/s" % agents['mcts'].stats()) 
+    else: 
+      import reversi ## The GUI, importing pygame
+      reversi.play(MyGame) 
+  finally:
+    ## Terminates the processes of the mcts agents
+    for agent in mcts_agents():
+      agent.close() 
     
 
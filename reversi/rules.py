@@ -0,0 +1,321 @@
+"""
+Rules
+-----
+
+Rules and game flow of reversi, independent of the graphic user interface
+(see reversi.py), so that games can be played without importing pygame.
+"""
+import numpy as np
+from threading import Thread 
+import queue 
+
+import bitboard 
+
+
+
+class Game (Thread):
+  """
+    Raversi game flow running in a separate thread with respect to 
+    the graphic user interface.
+  """
+  def __init__ (self):
+    """
+      Initialize the game
+    """
+    self.white = np.zeros ((8,8), dtype = np.float32)
+    self.black = np.zeros ((8,8), dtype = np.float32)
+
+    self.white[3,3]=1.
+    self.white[4,4]=1.
+    self.black[3,4]=1.
+    self.black[4,3]=1.
+
+    Thread.__init__(self) 
+    self._status = None 
+    ## Sequence of (side, white, black) with the boards after each move
+    self.history = [] 
+    ## Legal moves of the player to move, as (i,j) cells. Trusted agents 
+    ## may return the index of their move in this list (see _play_turn)
+    self.turn_moves = [] 
+    self._turn = None 
+    self._outcomes = dict() 
+    ## Cells clicked on the GUI, handed over to the game flow (see post_click)
+    self._clicks = queue.Queue() 
+
+  def run (self):
+    """
+      As defined in the Thread interface, run defines the function 
+      running in parallel to the main program. 
+  
+      Here, it defines the overall game flow:
+        if white can move
+          propose a move untill the proposed move is valid
+          update the board consequently 
+
+        if black can move
+          propose a move untill the proposed move is valid
+          update the board consequently 
+        
+        if neither white nor black can move
+          the match is over
+          compute the winner
+
+      The legal moves of the player to move are computed once per turn 
+      (see turn_moves) and reused to detect the end of the game.
+    """
+    self._running = True 
+    side, passed = 'white', False 
+    self._start_turn (self.white, self.black) 
+    while self._running: 
+
+      if len(self.turn_moves) > 0: 
+        passed = False 
+        if side == 'white':
+          outcome = self._play_turn ('white', self.white_moves) 
+        else:
+          outcome = self._play_turn ('black', self.black_moves) 
+        ## This is a hook for immediate termination of the game flow on stop
+        if not self._running: return 
+        if side == 'white':
+          self.white, self.black = outcome 
+        else:
+          self.black, self.white = outcome 
+        self.history.append ((side, self.white, self.black)) 
+      elif passed:
+        ## Neither white nor black can move
+        self.choose_winner ( self.white, self.black ) 
+        self._running = False 
+        break 
+      else:
+        passed = True 
+
+      side = 'black' if side == 'white' else 'white'
+      if side == 'white':
+        self._start_turn (self.white, self.black) 
+      else:
+        self._start_turn (self.black, self.white) 
+
+
+  def _play_turn (self, side, agent_moves):
+    """
+    Asks the agent for a move until the proposed move is valid. The agent
+    returns either the new boards, which are validated, or the index of 
+    the move in turn_moves (trusted agents), applied without further checks.
+    Returns the boards of the player and of the opponent after the move.
+    """
+    while True:
+      w0, b0 = self.white.copy(), self.black.copy() 
+      ret = agent_moves (w0, b0) 
+      if not self._running: return None 
+
+      if isinstance (ret, (int, np.integer)):
+        return self._turn_outcome (int(ret)) 
+
+      w, b = ret 
+      if self.check_valid (w, b, w0, b0, side): 
+        if side == 'white':
+          return self.move_outcome (w, b, w0, b0) 
+        return self.move_outcome (b, w, b0, w0) 
+
+
+  def _start_turn (self, player, opponent):
+    "Computes the legal moves of the player to move, listed in turn_moves"
+    p, o = bitboard.from_array(player), bitboard.from_array(opponent) 
+    self._turn = (p, o, list(bitboard.iter_bits (bitboard.valid_moves (p, o)))) 
+    self._outcomes = dict() 
+    self.turn_moves = [bitboard.bit2cell (m) for m in self._turn[2]] 
+
+
+  def _turn_outcome (self, index):
+    """
+    Boards of the player and of the opponent after the index-th move of
+    turn_moves, reusing the outcome computed by successors if any
+    """
+    p, o, moves = self._turn 
+    move = moves[index] 
+    if move not in self._outcomes:
+      self._outcomes[move] = bitboard.play (p, o, move) 
+    pn, on = self._outcomes[move] 
+    return bitboard.to_array (pn), bitboard.to_array (on) 
+
+
+  def stop(self): 
+    "Interrupt the game"
+    self._running = False 
+    self._clicks.put (None) ## wakes up the game flow waiting for a click
+    self.join() 
+
+
+  def post_click (self, cell):
+    "Hands over the cell clicked on the GUI to the game flow"
+    self._clicks.put (cell) 
+
+
+  def wait_click (self):
+    """
+    Blocks until a cell is clicked, discarding the clicks preceding the 
+    call. Returns None if the game was stopped in the meanwhile.
+    """
+    try:
+      while True:
+        self._clicks.get_nowait()
+    except queue.Empty:
+      pass 
+
+    ## stop() clears _running before waking up the queue
+    if not self._running: return None 
+    cell = self._clicks.get() 
+    return cell if self._running else None 
+
+
+  def white_moves (self, w0, b0):
+    "Function defining the white move, can be overridden to implement AI"
+    self._status = "White moves"
+    cell = self.wait_click() 
+    
+    w, b = w0.copy(), b0.copy()
+    if cell is not None:
+      w[cell] = 1
+    self._status = None
+    return w, b
+
+
+  def black_moves (self, w0, b0):
+    "Function defining the black move, can be overridden to implement AI"
+    self._status = "Black moves"
+    cell = self.wait_click() 
+
+    w, b = w0.copy(), b0.copy()
+    if cell is not None:
+      b[cell] = 1
+    self._status = None
+    return w, b
+
+
+  @property
+  def status (self):
+    "Read-only game status"
+    return self._status 
+
+
+  def list_valid_move (self, player, opponent):
+    """
+    Lists the empty cells which are viable options for a player's move, 
+    as obtained from the bitboard representation of the two boards. 
+    Returns the indices for the valid cells, in the order of turn_moves
+    """
+    p, o = bitboard.from_array(player), bitboard.from_array(opponent) 
+    if self._turn is not None and self._turn[:2] == (p, o):
+      return list(self.turn_moves) 
+    return bitboard.mask2cells (bitboard.valid_moves (p, o)) 
+          
+          
+  def move_index (self, player, opponent, move):
+    """
+    Index of the move (single-bit mask) of the player among its valid moves,
+    i.e. in turn_moves for the position of the turn, as returned by trusted
+    agents
+    """
+    return self.list_valid_move (player, opponent).index (bitboard.bit2cell (move)) 
+
+
+  def successors (self, player, opponent):
+    """
+    Lists the valid moves of a player together with their outcome. 
+    Returns the list of the cells and an array of shape (n_moves, 2, 8, 8)
+    stacking the (player, opponent) boards after each move. 
+    For the position of the turn, the cells are listed as in turn_moves and
+    the outcomes are kept to apply the move chosen by a trusted agent.
+    """
+    p, o = bitboard.from_array(player), bitboard.from_array(opponent) 
+    current = self._turn is not None and self._turn[:2] == (p, o) 
+    moves = self._turn[2] if current else bitboard.iter_bits (bitboard.valid_moves (p, o)) 
+    cells, outcomes = [], [] 
+    for move in moves:
+      cells.append (bitboard.bit2cell (move))
+      outcomes.append (bitboard.play (p, o, move))
+      if current:
+        self._outcomes[move] = outcomes[-1] 
+
+    return cells, bitboard.to_arrays (outcomes).reshape((-1, 2, 8, 8))
+          
+          
+  def _check_for_updates (self, p, o, p0, o0):
+    """
+    In reversi a valid move is a move with an outcome. This function evaluates
+    the outcome of the move in a sandbox and return True if at least one token
+    was reversed. 
+    """
+    pn, on = self.move_outcome (p, o, p0, o0) 
+    if np.all (p == pn) and np.all (o == on): 
+      return False
+    return True
+      
+
+  def move_outcome (self, p, o, p0, o0):
+    """
+    Compute the outcome of a move by reversing the required tokens.
+    """
+    pb, ob = bitboard.from_array(p), bitboard.from_array(o) 
+    new = pb & ~bitboard.from_array(p0) 
+
+    flipped = 0 
+    for move in bitboard.iter_bits (new):
+      flipped |= bitboard.flips (pb, ob, move) 
+
+    return bitboard.to_array (pb | flipped), bitboard.to_array (ob & ~flipped) 
+      
+    
+
+  def check_valid (self, w, b, w0, b0, player):
+    """
+    Validates the input defining a new move. It checks:
+     - only the player's board has changed 
+     - one and only one piece was added to the player's board 
+     - the move has an outcome  
+
+    Returns True on a valid move
+    """
+    ## Constantness of the other board 
+    if player == 'white' and np.any(b0 != b): return False 
+    if player == 'black' and np.any(w0 != w): return False 
+
+    ## Number of new items
+    if player == 'white' and np.count_nonzero(w - w0) != 1: return False 
+    if player == 'black' and np.count_nonzero(b - b0) != 1: return False 
+
+
+    iX, iY = np.indices ((8,8)) 
+
+    if player == 'white':
+      new = (w - w0).astype (bool) 
+      if b0[new]: 
+        return False 
+
+      return self._check_for_updates (w, b, w0, b0) 
+      
+    if player == 'black':
+      new = (b - b0).astype (bool) 
+      if w0[new] == 1: 
+        return False 
+
+      return self._check_for_updates (b, w, b0, w0)
+      
+    return True 
+       
+
+  def choose_winner (self, white, black):
+    """
+    Counts the number of black and white tokens and choose the winner
+    """
+    nw = np.count_nonzero (white)
+    nb = np.count_nonzero (black)
+    if nw > nb:
+      self._status = "White wins" 
+      return "white"
+    elif nb > nw:
+      self._status = "Black wins" 
+      return "black"
+    else:
+      self._status = "Parity" 
+      return "parity"
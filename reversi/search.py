@@ -0,0 +1,210 @@
+"""
+Search
+------
+
+Negamax search with alpha-beta pruning and iterative deepening.
+https://www.chessprogramming.org/Negamax
+https://www.chessprogramming.org/Iterative_Deepening
+
+The search runs on the bitboards (see bitboard.py) and deepens the search
+until the time budget per move is exhausted: the move returned is the best
+move of the deepest completed iteration. The best moves of the previous
+iterations are kept in a transposition table (see transposition.py) and
+searched first, followed by the corners, the borders and the other cells.
+
+The leaf evaluator is pluggable: the weights of the tactics agent or a
+network exposing score_positions (NeuralNetwork_agent, NumpyNetwork_agent).
+"""
+import time
+import numpy as np
+
+import bitboard
+import transposition
+
+
+## Bonus on the value of won games, which are preferred to any evaluation
+WIN = 1000
+
+
+def final_score (player, opponent):
+  "Value of a finished game for the player: disc differential plus WIN bonus"
+  diff = bitboard.count (player) - bitboard.count (opponent)
+  return diff + WIN * ((diff > 0) - (diff < 0))
+
+
+################################################################################
+## Evaluators.
+## An evaluator is a callable returning the value of a position for the
+## player to move, with a method batch evaluating a list of positions at once
+class TacticsEvaluator:
+  """
+  Weighted disc differential, with the weights of the tactics agent:
+  borders count twice, corners four times
+  """
+  def __call__ (self, player, opponent):
+    return (
+        bitboard.count (player) + bitboard.count (player & ~bitboard.INNER)
+          + 2 * bitboard.count (player & bitboard.CORNERS)
+      - bitboard.count (opponent) - bitboard.count (opponent & ~bitboard.INNER)
+          - 2 * bitboard.count (opponent & bitboard.CORNERS)
+      )
+
+  def batch (self, positions):
+    return np.array ([self(p, o) for p, o in positions], dtype=np.float32)
+
+
+class NetworkEvaluator:
+  """
+  Evaluation of the network of an agent exposing score_positions.
+  The network scores the position reached by a player with its move, so
+  the value for the player to move is minus the score of the opponent.
+  """
+  def __init__ (self, network):
+    self.network = network
+
+  def __call__ (self, player, opponent):
+    return float (self.batch ([(player, opponent)])[0])
+
+  def batch (self, positions):
+    boards = bitboard.to_arrays ([(o, p) for p, o in positions])
+    return -self.network.score_positions (boards.reshape((len(positions), -1)))
+
+
+class _Timeout (Exception):
+  "Raised to interrupt the search when the time budget is exhausted"
+
+
+################################################################################
+## Agent
+class NegamaxAgent:
+  """
+  Agent choosing its moves with an alpha-beta negamax search with iterative
+  deepening, up to max_depth or within budget_ms milliseconds per move.
+  The statistics of the last search are stored in the attribute last.
+  """
+  def __init__ (self, evaluator=None, budget_ms=100, max_depth=60, table=None):
+    self.evaluator = evaluator if evaluator is not None else TacticsEvaluator()
+    self.budget_ms = budget_ms
+    self.max_depth = max_depth
+    self.table = table if table is not None else (
+        transposition.TranspositionTable (200000, symmetric=False) )
+    self.last = None
+    self._deadline = None
+    self._nodes = 0
+
+
+  def __call__ (self, game, player, opponent):
+    move = self.search (bitboard.from_array(player), bitboard.from_array(opponent))
+    return game.move_index (player, opponent, move)
+
+
+  def search (self, player, opponent):
+    """
+    Iterative deepening from the position defined by the two bitboards.
+    Returns the single-bit mask of the chosen move.
+    """
+    start = time.perf_counter()
+    empties = 64 - bitboard.count (player | opponent)
+    self._nodes = 0
+    best = None
+    for depth in range(1, min(self.max_depth, empties) + 1):
+      ## The first iteration always completes, to guarantee a move
+      self._deadline = start + self.budget_ms * 1e-3 if depth > 1 else float('inf')
+      try:
+        value, best = self._root (player, opponent, depth)
+      except _Timeout:
+        break
+
+      self.last = dict(depth=depth, value=value, nodes=self._nodes,
+                       ms=(time.perf_counter() - start) * 1e3)
+      if abs(value) >= WIN:
+        break  ## The game is solved
+
+    return best
+
+
+  def _ordered_moves (self, moves, first):
+    "Moves ordered as: first (the best move found so far), corners, borders, others"
+    ordered = [first] if first is not None and moves & first else []
+    for region in (bitboard.CORNERS, bitboard.BORDERS, bitboard.INNER):
+      for move in bitboard.iter_bits (moves & region):
+        if move != first:
+          ordered.append (move)
+    return ordered
+
+
+  def _root (self, player, opponent, depth):
+    "Searches all the moves at the root, returns the best value and move"
+    hit = self.table.probe (player, opponent)
+    moves = self._ordered_moves (bitboard.valid_moves (player, opponent),
+                                 hit[3] if hit is not None else None)
+    alpha, best = -float('inf'), moves[0]
+    for move in moves:
+      p, o = bitboard.play (player, opponent, move)
+      value = -self._negamax (o, p, depth - 1, -float('inf'), -alpha)
+      if value > alpha:
+        alpha, best = value, move
+
+    self.table.store (player, opponent, alpha, depth, 'exact', best)
+    return alpha, best
+
+
+  def _negamax (self, player, opponent, depth, alpha, beta):
+    "Value of the position for the player to move"
+    self._nodes += 1
+    if time.perf_counter() > self._deadline:
+      raise _Timeout
+
+    alpha0 = alpha
+    first = None
+    hit = self.table.probe (player, opponent)
+    if hit is not None:
+      value, d, flag, first = hit
+      if d >= depth:
+        if flag == 'exact': return value
+        if flag == 'lower': alpha = max(alpha, value)
+        if flag == 'upper': beta = min(beta, value)
+        if alpha >= beta: return value
+
+    moves = bitboard.valid_moves (player, opponent)
+    if moves == 0:
+      if bitboard.valid_moves (opponent, player) == 0:
+        return final_score (player, opponent)
+      return -self._negamax (opponent, player, depth, -beta, -alpha)
+
+    if depth <= 0:
+      return self.evaluator (player, opponent)
+
+    ordered = self._ordered_moves (moves, first)
+
+    if depth == 1:
+      ## Frontier: the finished games are scored exactly, and all the other
+      ## children are evaluated in a single batch
+      children = [bitboard.play (player, opponent, m) for m in ordered]
+      values = np.zeros (len(children), dtype=np.float32)
+      live = []
+      for i, (p, o) in enumerate(children):
+        if bitboard.valid_moves (o, p) == 0 and bitboard.valid_moves (p, o) == 0:
+          values[i] = final_score (p, o)
+        else:
+          live.append (i)
+      if len(live) > 0:
+        values[live] = -self.evaluator.batch ([children[i][::-1] for i in live])
+      iBest = int(np.argmax (values))
+      value, best = float(values[iBest]), ordered[iBest]
+    else:
+      value, best = -float('inf'), ordered[0]
+      for move in ordered:
+        p, o = bitboard.play (player, opponent, move)
+        v = -self._negamax (o, p, depth - 1, -beta, -alpha)
+        if v > value:
+          value, best = v, move
+        alpha = max(alpha, value)
+        if alpha >= beta:
+          break
+
+    if value <= alpha0: flag = 'upper'
+    elif value >= beta: flag = 'lower'
+    else: flag = 'exact'
+    self.table.store (player, opponent, value, depth, flag, best)
+    return value
@@ -0,0 +1,87 @@
+"""
+Board symmetries
+----------------
+
+The 8 symmetries of the square (rotations and reflections) applied to
+numpy boards of shape (..., 8, 8), e.g. a batch of (player, opponent)
+positions of shape (n, 2, 8, 8). Each symmetry is a precomputed
+permutation of the 64 cells, so that the 8 variants of a whole batch are
+obtained with a single fancy-indexing operation.
+
+The symmetries are listed in the order of bitboard.SYMMETRIES:
+  b, b[::-1], b[:,::-1], b[::-1,::-1], b.T, b.T[::-1], b.T[:,::-1], b.T[::-1,::-1]
+"""
+import numpy as np
+
+_CELLS_ = np.arange (64).reshape((8,8))
+
+## PERMUTATIONS[k] maps the flattened board onto its k-th symmetric variant
+PERMUTATIONS = np.stack ([t(_CELLS_).reshape(-1) for t in (
+  lambda b: b,
+  lambda b: b[::-1],
+  lambda b: b[:,::-1],
+  lambda b: b[::-1,::-1],
+  lambda b: b.T,
+  lambda b: b.T[::-1],
+  lambda b: b.T[:,::-1],
+  lambda b: b.T[::-1,::-1],
+)])
+
+## INVERSE_PERMUTATIONS[k] undoes PERMUTATIONS[k]
+INVERSE_PERMUTATIONS = np.argsort (PERMUTATIONS, axis=1)
+
+
+def transforms (boards):
+  """
+  The 8 symmetric variants of boards of shape (..., 8, 8), as an array of
+  shape (8, ..., 8, 8)
+  """
+  boards = np.asarray (boards)
+  flat = boards.reshape (boards.shape[:-2] + (64,))
+  variants = flat[..., PERMUTATIONS]        ## (..., 8, 64)
+  return np.moveaxis (variants, -2, 0).reshape ((8,) + boards.shape)
+
+
+def transform (boards, k):
+  "The k-th symmetric variant of boards of shape (..., 8, 8)"
+  boards = np.asarray (boards)
+  flat = boards.reshape (boards.shape[:-2] + (64,))
+  return flat[..., PERMUTATIONS[k]].reshape (boards.shape)
+
+
+def inverse_transform (boards, k):
+  "Undoes transform (boards, k)"
+  boards = np.asarray (boards)
+  flat = boards.reshape (boards.shape[:-2] + (64,))
+  return flat[..., INVERSE_PERMUTATIONS[k]].reshape (boards.shape)
+
+
+def canonical (positions):
+  """
+  Canonical form of positions of shape (..., 2, 8, 8): among the 8
+  symmetric variants, the one with the smallest packed representation.
+  Symmetric positions share the same canonical form, which can be used as
+  a cache key. Returns the canonical positions, the 16-byte keys (array of
+  shape (..., 16) of uint8) and the index k of the symmetry applied.
+  """
+  positions = np.asarray (positions)
+  batch_shape = positions.shape[:-3]
+  variants = transforms (positions).reshape ((8, -1, 128))
+  packed = np.packbits (variants > 0, axis=-1)                  ## (8, n, 16)
+  words = packed.view ('>u8')                                   ## (8, n, 2)
+  k = np.lexsort ((words[..., 1], words[..., 0]), axis=0)[0]    ## (n,)
+  n = np.arange (len(k))
+  return ( variants[k, n].reshape (positions.shape),
+           packed[k, n].reshape (batch_shape + (16,)),
+           k.reshape (batch_shape) )
+
+
+def averaged_scores (score_positions, batch):
+  """
+  Scores of a batch of flattened (player, opponent) positions, averaged
+  over their 8 symmetric variants. score_positions is the scoring function
+  of a network (see NeuralNetwork_agent), called once on the 8n variants.
+  """
+  positions = np.asarray (batch, dtype=np.float32).reshape ((-1, 2, 8, 8))
+  variants = transforms (positions).reshape ((8 * len(positions), -1))
+  return np.asarray (score_positions (variants)).reshape ((8, -1)).mean (axis=0)
@@ -0,0 +1,226 @@
+"""
+Transposition table
+-------------------
+
+Cache of the results of the searches (see search.py) on reversi positions.
+Positions are identified by the Zobrist hash of the bitboards (see
+bitboard.py) of the player to move and of the opponent.
+https://www.chessprogramming.org/Zobrist_Hashing
+
+A lookup costs a good fraction of the generation of the valid moves
+(bitboard.valid_moves), so the moves and flipped tokens are not cached.
+
+Optionally (symmetric=True), the position is first brought to a canonical
+form among its 8 symmetric variants (see canonical), so that mirrored or
+rotated positions share the same entry. Moves are stored in the canonical
+frame and mapped back on lookup. This costs 8 hashes per lookup, which a
+search cannot afford: canonical pays off only for rare lookups, e.g. in
+the opening book (see book.py).
+
+The table has a bounded number of entries. The least recently used entry
+is evicted when the table is full, while a new search result replaces the
+stored one only if it was obtained with a depth not smaller.
+
+Running this module compares the time of searches of fixed depth with a
+table keeping no entry and with a table of the given size, e.g.
+  python transposition.py --depth 6 --entries 200000
+"""
+import random
+from collections import OrderedDict
+
+import bitboard
+
+
+## Zobrist keys, tabulated per byte of the bitboards:
+## _ZOBRIST_[side][k][byte] is the xor of the keys of the tokens of side
+## set in byte, the k-th byte (the k-th row of the board)
+def _zobrist_tables (seed=20201015):
+  rnd = random.Random (seed)
+  tables = []
+  for side in range(2):
+    keys = [rnd.getrandbits(64) for _ in range(64)]
+    side_table = []
+    for k in range(8):
+      row = [0] * 256
+      for byte in range(1, 256):
+        lsb = byte & -byte
+        row[byte] = row[byte ^ lsb] ^ keys[8*k + lsb.bit_length() - 1]
+      side_table.append (row)
+    tables.append (side_table)
+  return tables
+
+_ZOBRIST_ = _zobrist_tables()
+
+
+def zobrist (player, opponent):
+  "Zobrist hash of the position defined by two bitboards"
+  zp, zo = _ZOBRIST_
+  h = 0
+  for k in range(8):
+    h ^= zp[k][(player >> 8*k) & 0xFF] ^ zo[k][(opponent >> 8*k) & 0xFF]
+  return h
+
+
+def canonical (player, opponent):
+  """
+  Returns the hash of the canonical form of the position, the index of
+  the symmetry (see bitboard.SYMMETRIES) bringing the position in its
+  canonical form, and the transformed boards
+  """
+  best = None
+  for k, symmetry in enumerate(bitboard.SYMMETRIES):
+    p, o = symmetry (player), symmetry (opponent)
+    h = zobrist (p, o)
+    if best is None or h < best[0]:
+      best = (h, k, p, o)
+  return best
+
+
+class Entry:
+  "Information cached on a position, in its canonical frame"
+  __slots__ = ('player', 'opponent', 'value', 'depth', 'flag', 'best')
+
+  def __init__ (self, player, opponent):
+    self.player = player
+    self.opponent = opponent
+    self.value = None      ## search result
+    self.depth = -1        ## depth of the search defining value
+    self.flag = None       ## 'exact', 'lower' or 'upper' bound
+    self.best = None       ## best move found by the search
+
+
+class TranspositionTable:
+  """
+  Bounded cache of Entry objects indexed by the Zobrist hash of the
+  positions, or of their canonical form if symmetric.
+  The hit-rate statistics are returned by stats().
+  """
+  def __init__ (self, capacity=1000000, symmetric=False):
+    self.capacity = capacity
+    self.symmetric = symmetric
+    self._entries = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.collisions = 0
+
+
+  def __len__ (self):
+    return len(self._entries)
+
+
+  def _locate (self, player, opponent):
+    "Hash, symmetry index and boards in the frame used by the table"
+    if self.symmetric:
+      return canonical (player, opponent)
+    return zobrist (player, opponent), 0, player, opponent
+
+
+  def lookup (self, player, opponent, create=False, count=True):
+    """
+    Returns the entry of a position and the index of the symmetry mapping
+    the position onto the frame of the entry. If the position is not in
+    the table, the entry is None unless create is True. The lookup counts
+    as a hit or a miss (see stats) only if count is True.
+    """
+    h, k, p, o = self._locate (player, opponent)
+    entry = self._entries.get (h)
+    if entry is not None and (entry.player != p or entry.opponent != o):
+      ## Two positions sharing the same hash, the newest one wins
+      self.collisions += 1
+      entry = None
+
+    if entry is not None:
+      self.hits += count
+      self._entries.move_to_end (h)
+    else:
+      self.misses += count
+      if create:
+        entry = Entry (p, o)
+        self._entries[h] = entry
+        self._entries.move_to_end (h)
+        if len(self._entries) > self.capacity:
+          self._entries.popitem (last=False)
+          self.evictions += 1
+
+    return entry, k
+
+
+  def store (self, player, opponent, value, depth, flag='exact', best=None):
+    """
+    Stores the result of a search of the given depth, unless a deeper
+    result is already available. best is the single-bit mask of the best
+    move, if any. Writes are not counted in the hit rate.
+    """
+    entry, k = self.lookup (player, opponent, create=True, count=False)
+    if depth < entry.depth:
+      return
+    entry.value = value
+    entry.depth = depth
+    entry.flag = flag
+    entry.best = None if best is None else bitboard.SYMMETRIES[k] (best)
+
+
+  def probe (self, player, opponent):
+    """
+    Returns (value, depth, flag, best) as stored for the position, with best
+    mapped back to the frame of the position, or None if not available
+    """
+    entry, k = self.lookup (player, opponent)
+    if entry is None or entry.value is None:
+      return None
+    best = None if entry.best is None else bitboard.INVERSE_SYMMETRIES[k] (entry.best)
+    return entry.value, entry.depth, entry.flag, best
+
+
+  @property
+  def hit_rate (self):
+    "Fraction of the lookups (not the writes) finding the position in the table"
+    n = self.hits + self.misses
+    return self.hits / n if n > 0 else 0.
+
+
+  def stats (self):
+    "Usage statistics, to size the table"
+    return dict(
+      entries = len(self),
+      capacity = self.capacity,
+      hits = self.hits,
+      misses = self.misses,
+      hit_rate = self.hit_rate,
+      evictions = self.evictions,
+      collisions = self.collisions,
+    )
+
+
+
+if __name__ == '__main__':
+  import time
+  import argparse
+  import search
+  parser = argparse.ArgumentParser()
+  parser.add_argument ("-d", "--depth", default = 5, type = int,
+      help = "Depth of the searches")
+  parser.add_argument ("-e", "--entries", default = 200000, type = int,
+      help = "Capacity of the table")
+  parser.add_argument ("-m", "--moves", default = 30, type = int,
+      help = "Moves of the game played by the searches")
+  cfg = parser.parse_args()
+
+  ## Games from the initial position, played by searches of fixed depth with
+  ## the tactics evaluator, without and with the best moves and bounds kept
+  for capacity in (0, cfg.entries):
+    agent = search.NegamaxAgent (budget_ms = float('inf'), max_depth = cfg.depth,
+                                 table = TranspositionTable (capacity, symmetric=False))
+    p, o = 0x0000000810000000, 0x0000001008000000
+    n_moves, n_nodes = 0, 0
+    start = time.perf_counter()
+    while n_moves < cfg.moves and (bitboard.valid_moves (p, o) or bitboard.valid_moves (o, p)):
+      if bitboard.valid_moves (p, o):
+        p, o = bitboard.play (p, o, agent.search (p, o))
+        n_moves += 1
+        n_nodes += agent.last['nodes']
+      p, o = o, p
+    elapsed = time.perf_counter() - start
+    print ("%7d entries %3d moves %9d nodes %8.2f s %8.1f ms/move  hit rate %.3f" % (
+      capacity, n_moves, n_nodes, elapsed, elapsed * 1e3 / n_moves, agent.table.hit_rate))